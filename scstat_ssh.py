@@ -9,7 +9,6 @@
 
 
 import sys
-import paramiko
 import time
 import getopt
 
@@ -18,6 +17,35 @@ delimiter_svc = ','                                         # Delimiter for the
 delimiter_csv = ','                                         # Delimiter we want to see in CSV output
 sample_count = 1000000000                                   # The number of samples we are interested in
 skip_zero = True                                            # Set 'False' here to show lines with zero values
+export_port = 0                                             # Serve lssystemstats in Prometheus format on the port
+history_file = ''                                           # Rolling history file to record the samples to
+record_file = ''                                            # Log to record the samples to, see svcreplay.py
+alerts_file = ''                                            # File to append anomaly alerts to, see svcalert.py
+replay_file = ''                                            # Recorded log to replay instead of the storage system
+replay_speed = 1.0                                          # Replay speed, 0 is as fast as possible
+remote_loop = False                                         # Run the sampling loop on the storage system itself
+target = ''
+exporter = None                                             # svcexport.Exporter with -e
+history = None                                              # svchist.History with -r
+recorder = None                                             # svcreplay.Recorder with -W
+detector = None                                             # svcalert.Detector with -A
+report_period = 0                                           # Seconds between instrumentation summary lines
+report_file = ''                                            # File to append instrumentation JSON snapshots to
+instruments = None                                          # svcinstr.Instruments with -I or -J
+reporter = None                                             # svcinstr.Reporter with -I or -J
+ssh_retries = 3                                             # Reconnect attempts before giving up without -D
+ssh_backoff = 1                                             # First reconnect delay, seconds, doubled on each failure
+ssh_timeout = 60                                            # SSH command and health check timeout, seconds
+ssh_grace = 5                                               # Seconds a streamed sample may be late over 2 intervals
+daemon = False                                              # Keep collecting through failures, handle signals
+supervisor = None                                           # svcdaemon.Supervisor with -D
+backoff = None                                              # svcdaemon.Backoff of the reconnects
+pool = None                                                 # svcdaemon.SessionPool of SSH sessions
+ssh_client = None                                           # Session in use
+pace = ()                                                   # (fastest, slowest) seconds of adaptive polling with -v
+budget_rate = 0                                             # Queries per hour of fast adaptive polls, 0 is unlimited
+budget_file = ''                                            # Budget file shared by the collectors of a host
+pacer = None                                                # svcpace.Pacer with -v
 out_format = 'stat'                                         # Default output format is 'stat'. We support CSV as well.
 # out_format = 'csv'
 output_formats = ('stat', 'csv')                            # Supported output formats
@@ -29,6 +57,11 @@ nop_error = 'Error! You must specify all mandatory options to get data.'
 frequency_error = 'Error! Wrong frequency interval. Use 1 to 60 seconds.'
 count_error = 'Error! Wrong [-s count] value.'
 outformat_error = 'Error! Wrong output format specified.'
+port_error = 'Error! Wrong [-e port] value.'
+speed_error = 'Error! Wrong [-x speed] value.'
+report_error = 'Error! Wrong [-I seconds] value.'
+pace_error = 'Error! Wrong [-v min,max] value. Use 1 to 3600 seconds, min not more than max.'
+budget_error = 'Error! Wrong [-b queries[,file]] value.'
 
 
 def usage(err_code=1, err_text=''):
@@ -38,7 +71,10 @@ def usage(err_code=1, err_text=''):
     print('Report IBM SVC/Storwize Cluster-level performance statistics\n'
           '\n'
           'Usage:\n'
-          '\tscstat_ssh.py -a address -u user -p password [-f seconds][-s count][-o stat|csv][-z]\n'
+          '\tscstat_ssh.py -a address -u user -p password [-f seconds][-s count][-o stat|csv][-z][-l][-r file][-e port]\n'
+          '\t\t[-W file][-I seconds][-J file][-D][-A file][-v min,max [-b queries[,file]]]\n'
+          '\tscstat_ssh.py -P file [-x speed][-s count][-o stat|csv][-z][-r file][-e port][-I seconds][-J file]\n'
+          '\t\t[-A file][-v min,max [-b queries[,file]]]\n'
           '\n'
           'Options:\n'
           '\t-a address -u user -p password\n'
@@ -50,108 +86,505 @@ def usage(err_code=1, err_text=''):
           '\t[-o stat|csv]\n'
           'Output format style. Default is "stat"\n'
           '\t[-z]\n'
-          'Show lines with zero values\n')
+          'Show lines with zero values\n'
+          '\t[-l]\n'
+          'Run the sampling loop on the storage system and read its output as a stream over one SSH session.\n'
+          'A stream silent for two intervals is taken as a failed session\n'
+          '\t[-r file]\n'
+          'Record current values into the rolling history file with 24h/48h/7d AVERAGE and MAX tiers. See svchist.py\n'
+          '\t[-e port]\n'
+          'Exporter mode: serve current values in Prometheus text format on http://host:port/metrics instead of\n'
+          'printing them, labeled with the "target" address\n'
+          '\t[-W file]\n'
+          'Record lssystemstats output into the gzip log file while collecting. See svcreplay.py\n'
+          '\t-P file [-x speed]\n'
+          'Replay the recorded log instead of connecting to the storage system. The recorded intervals are\n'
+          'shortened "speed" times (default 1), 0 replays them as fast as possible\n'
+          '\t[-I seconds] [-J file]\n'
+          'Time the fetch, parse, output and record stages of every sample into latency histograms, count samples,\n'
+          'received bytes, reconnects and skipped intervals. Every "seconds" (default 60 with -J) print a summary\n'
+          'line to stderr and/or append a JSON snapshot to the file. See svcinstr.py\n'
+          '\t[-D]\n'
+          'Daemon mode: keep a standby SSH session, health check it between samples and switch to it at once if a\n'
+          'command fails, reconnect with exponential backoff instead of exiting. SIGHUP reopens the sessions, the\n'
+          'history and -J files, SIGTERM and SIGINT finish the sample in flight and exit\n'
+          '\t[-A file]\n'
+          'Alert on current values that stray from their moving average by more than 4 standard deviations. Alerts\n'
+          'are printed to stderr and appended to the file as JSON lines. See svcalert.py\n'
+          '\t[-v min,max]\n'
+          'Adaptive polling instead of -f: poll every "max" seconds while the system is quiet, every "min" seconds\n'
+          'as soon as cpu_pc, write_cache_pc or a response time crosses its threshold or a value changes quickly,\n'
+          'and double the interval back after quiet samples. The queries saved against polling every "min"\n'
+          'seconds are reported on exit and with -I/-J. Not supported with -l. A replayed log is polled by its\n'
+          'recorded times. See svcpace.py\n'
+          '\t[-b queries[,file]]\n'
+          'Budget of queries per hour of adaptive polls faster than "max". The collectors sharing the budget file\n'
+          'share the budget, e.g. all the collectors of a fleet on a host. Polls every "max" seconds are not limited\n')
     sys.exit(err_code)
 
 
-def ssh_exec(command, target, user, password, port=22):
-    """Execute a command via SSH and read results"""
+def ssh_connect(target, user, password, port=22):
+    """Open an authenticated SSH session. It is kept open and reused for all the samples"""
+
+    import paramiko
 
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(target, username=user, password=password, port=port)
+    return client
+
+
+def ssh_alive(client):
+    """Health check of an idle session: its transport is up and the storage system opens a channel"""
+
+    transport = client.get_transport()
+    if not transport or not transport.is_active():
+        return False
+    transport.open_session(timeout=ssh_timeout).close()
+    return True
+
 
+def decode(data):
     try:
-        client.connect(target, username=user, password=password, port=port)
-    except:
-        print('Error: {user}@{targ}: Target is inaccessible:'.format(user=user, targ=target), sys.exc_info()[1])
-        sys.exit(1)
+        return data.decode('UTF-8')
+    except UnicodeDecodeError:
+        return data.decode('US-ASCII')
+
 
-    stdin, stdout, stderr = client.exec_command(command)
+def ssh_exec(command, client):
+    """Execute a command via SSH and read results. Raises RuntimeError if the command reports an error"""
+
+    stdin, stdout, stderr = client.exec_command(command, timeout=ssh_timeout)
 
     error = stderr.read()
     if error:
-        error = error.decode('US-ASCII')
-        print('Error: {user}@{targ}: "{cmd}" returned: {err}'.format(user=user, targ=target, cmd=command, err=error))
-        client.close()
-        sys.exit(1)
+        raise RuntimeError('"{cmd}" returned: {err}'.format(cmd=command, err=error.decode('US-ASCII').strip()))
+
+    return decode(stdout.read())
 
-    data = stdout.read()
-    client.close()
 
+def ssh_stream(command, client, timeout=None):
+    """Execute a long running command via SSH and yield its output line by line as soon as it arrives. If no
+    output arrives for 'timeout' seconds, RuntimeError is raised, so a hung session is not waited for forever"""
+
+    import socket
+
+    stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
     try:
-        data = data.decode('UTF-8')
-    except UnicodeDecodeError:
-        data = data.decode('US-ASCII')
+        for ln in stdout:
+            yield ln.rstrip('\r\n')
+    except socket.timeout:
+        raise RuntimeError('No output of "{}" for {} seconds'.format(command, timeout)) from None
 
-    return data
 
+def lap(stage, t0):
+    """Record the time since 't0' into the 'stage' histogram if instrumentation is on. Returns the current time"""
+    t1 = time.perf_counter()
+    if instruments:
+        instruments.record(stage, t1 - t0)
+    return t1
 
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'a:u:p:f:s:o:z')
-except getopt.GetoptError as err:
-    usage(1, str(err))
 
-if not opts:
-    usage(1, nop_error)
+def drop_session():
+    """Close the session in use, the next sample takes a standby session or opens a new one"""
+    global ssh_client
 
-for opt, arg in opts:
-    if opt == '-a':
-        target = arg
-    elif opt == '-u':
-        user = arg
-    elif opt == '-p':
-        password = arg
-    elif opt == '-f':                                   # frequency
-        try:
-            frequency = int(arg)
-        except ValueError or frequency > 60 or frequency < 1:
-            usage(1, frequency_error)
-    elif opt == '-s':                                   # Sample count
-        try:
-            sample_count = int(arg)
-        except ValueError:
-            usage(1, count_error)
-    elif opt == '-z':                                   # How to deal with zeroes
-        skip_zero = False
-    elif opt == '-o':
-        if arg in output_formats:
-            out_format = arg
-        else:
-            usage(1, outformat_error)
+    if ssh_client:
+        pool.discard(ssh_client)
+        ssh_client = None
+
+
+def session_failed(err, user):
+    """Drop the session, report the error and sleep before the next attempt unless a standby session is there.
+    Without -D give up after 'ssh_retries' failures in a row"""
+
+    drop_session()
+    print('Error: {user}@{targ}: {err}'.format(user=user, targ=target, err=err), file=sys.stderr)
+    if instruments:
+        instruments.count('retries')
+    if pool.idle:
+        return
+    if not supervisor and backoff.failures >= ssh_retries:
+        finish(1)
+    delay = backoff.delay()
+    if supervisor:
+        supervisor.sleep(delay)
     else:
-        pass                                            # Unknown options are detected by getopt() exception above
+        time.sleep(delay)
 
-if out_format == 'csv':
-    # Write header once only
-    print(delimiter_csv.join(header))
 
-while True:
+def keepalive(user):
+    """Health check the standby sessions and open the missing ones"""
+    try:
+        pool.refresh()
+    except Exception as err:
+        print('Error: {user}@{targ}: Standby session: {err}'.format(user=user, targ=target, err=err), file=sys.stderr)
+
+
+def handle_signals():
+    """Reopen the sessions, the history and instrumentation files on SIGHUP. Returns True on SIGTERM or SIGINT"""
+    global history
+
+    if not supervisor:
+        return False
+    if supervisor.reloading():
+        drop_session()
+        pool.close()
+        if history:
+            history.close()
+            history = None                                  # Opened again by the next record()
+        if reporter:
+            reporter.reopen()
+    return supervisor.stop
+
+
+def finish(err_code=0):
+    """Close the sessions and files, report the last instrumentation snapshot and exit"""
+
+    if pool:
+        drop_session()
+        pool.close()
+    if recorder:
+        recorder.close()
+    if history:
+        history.close()
+    if reporter:
+        reporter.tick(pacer.counters if pacer else None, force=True)
+    if pacer:
+        print(pacer.summary(), file=sys.stderr)
+    sys.exit(err_code)
+
+
+def print_header():
     if out_format != 'csv':
         # Clear screen and move cursor to the upper left corner
         sys.stdout.write("\x1b[2J\x1b[H")
-
-    stats_raw = ssh_exec('lssystemstats -delim {}'.format(delimiter_svc), target, user, password)
-
-    if out_format == 'stat':
         # Write header for each sample
         print('{0:19s}{1:>12s}{2:>12s}{3:>18s}'.format(header[0], header[1], header[2], header[3]))
 
-    for ln in stats_raw.split('\n')[1:]:
-        if ln:
-            stats = ln.split(delimiter_svc)
-            if skip_zero and stats[1] == '0' and stats[2] == '0':
-                pass
+
+def sample_values(lines):
+    """Return {stat_name: stat_current} of a sample"""
+    values = {}
+    for ln in lines:
+        stats = ln.split(delimiter_svc)
+        try:
+            values[stats[0]] = float(stats[1])
+        except (IndexError, ValueError):
+            pass
+    return values
+
+
+def record(lines, timestamp=None):
+    """Add the sample into the history file, create it on the first call with all the metrics we see. The history
+    row is stamped with the 'timestamp' of the sample, e.g. its recorded time in a replay, or the current time.
+    Publish it to the exporter if we have one, check it for anomalies with -A. Returns {stat_name: stat_current}"""
+    global history
+
+    values = sample_values(lines)
+    if detector:
+        detector.check_values('system', values, (('target', target),))
+    if history_file:
+        if not history:
+            import svchist
+
+            history = svchist.History(history_file, sorted(values))
+        history.update(values, timestamp)
+    if exporter:
+        import svcexport
+
+        exporter.publish('system', svcexport.render_values('svc_system', values, (('target', target),)))
+    return values
+
+
+def print_line(ln):
+    stats = ln.split(delimiter_svc)
+    if skip_zero and stats[1] == '0' and stats[2] == '0':
+        return
+
+    if out_format == 'csv':
+        # We want CSV format
+        print(delimiter_csv.join(stats), flush=True)
+    else:
+        # We want nice stat format
+        peak_time = time.strftime('%y-%m-%d %H:%M:%S', time.strptime(stats[3], '%y%m%d%H%M%S'))
+        print('{0:19s}{1:>12s}{2:>12s}{3:>18s}'.format(stats[0], stats[1], stats[2], peak_time), flush=True)
+
+
+def main():
+    global frequency, sample_count, skip_zero, export_port, history_file, record_file, replay_file, replay_speed
+    global remote_loop, out_format, target, exporter, history, report_period, report_file, instruments, daemon
+    global recorder, reporter, supervisor, backoff, pool, ssh_client, alerts_file, detector
+    global pace, budget_rate, budget_file, pacer
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'a:u:p:f:s:o:zlr:e:W:P:x:I:J:DA:v:b:')
+    except getopt.GetoptError as err:
+        usage(1, str(err))
+
+    if not opts:
+        usage(1, nop_error)
+
+    target = user = password = ''
+    for opt, arg in opts:
+        if opt == '-a':
+            target = arg
+        elif opt == '-u':
+            user = arg
+        elif opt == '-p':
+            password = arg
+        elif opt == '-f':                                   # frequency
+            try:
+                frequency = int(arg)
+            except ValueError or frequency > 60 or frequency < 1:
+                usage(1, frequency_error)
+        elif opt == '-s':                                   # Sample count
+            try:
+                sample_count = int(arg)
+            except ValueError:
+                usage(1, count_error)
+        elif opt == '-z':                                   # How to deal with zeroes
+            skip_zero = False
+        elif opt == '-l':                                   # Remote sampling loop
+            remote_loop = True
+        elif opt == '-r':                                   # History file
+            history_file = arg
+        elif opt == '-W':                                   # Record log
+            record_file = arg
+        elif opt == '-P':                                   # Replay log
+            replay_file = arg
+        elif opt == '-x':
+            try:
+                replay_speed = float(arg)
+                if replay_speed < 0:
+                    raise ValueError
+            except ValueError:
+                usage(1, speed_error)
+        elif opt == '-I':                                   # Instrumentation summary period
+            try:
+                report_period = int(arg)
+                if report_period < 1:
+                    raise ValueError
+            except ValueError:
+                usage(1, report_error)
+        elif opt == '-J':                                   # Instrumentation snapshots
+            report_file = arg
+        elif opt == '-D':                                   # Daemon mode
+            daemon = True
+        elif opt == '-A':                                   # Anomaly alerts
+            alerts_file = arg
+        elif opt == '-v':                                   # Adaptive polling
+            try:
+                pace = tuple(int(val) for val in arg.split(','))
+                if len(pace) != 2 or not 1 <= pace[0] <= pace[1] <= 3600:
+                    raise ValueError
+            except ValueError:
+                usage(1, pace_error)
+        elif opt == '-b':                                   # Adaptive polling budget
+            rate, _, budget_file = arg.partition(',')
+            try:
+                budget_rate = int(rate)
+                if budget_rate < 1:
+                    raise ValueError
+            except ValueError:
+                usage(1, budget_error)
+        elif opt == '-e':                                   # Exporter port
+            try:
+                export_port = int(arg)
+            except ValueError:
+                usage(1, port_error)
+        elif opt == '-o':
+            if arg in output_formats:
+                out_format = arg
             else:
-                if out_format == 'csv':
-                    # We want CSV format
-                    print(delimiter_csv.join(stats), flush=True)
+                usage(1, outformat_error)
+        else:
+            pass                                            # Unknown options are detected by getopt() exception above
+
+    if not replay_file and (not target or not user or not password):
+        usage(1, nop_error)
+    if pace and remote_loop:
+        usage(1, 'Error! Adaptive polling is not supported with the remote sampling loop.')
+    if budget_rate and not pace:
+        usage(1, 'Error! The query budget applies to adaptive polling only, specify -v min,max.')
+
+    if pace:
+        import svcpace
+
+        pacer = svcpace.Pacer(pace[0], pace[1], svcpace.Budget(budget_rate, budget_file) if budget_rate else None)
+        frequency = pacer.interval
+
+    if export_port:
+        import svcexport
+
+        exporter = svcexport.Exporter(export_port)
+    elif out_format == 'csv':
+        # Write header once only
+        print(delimiter_csv.join(header))
+
+    if alerts_file:
+        import svcalert
+
+        detector = svcalert.Detector(alerts_file)
+
+    if report_period or report_file:
+        import svcinstr
+
+        instruments = svcinstr.Instruments()
+        reporter = svcinstr.Reporter(instruments, report_period or 60, report_file, text=bool(report_period))
+
+    command = 'lssystemstats -delim {}'.format(delimiter_svc)
+    if record_file or replay_file:
+        import svcreplay
+
+    if record_file:
+        recorder = svcreplay.Recorder(record_file)
+
+    if replay_file:
+        # The recorded samples stand for the storage system, they are paced by the recorded times
+        replay = svcreplay.Replay(replay_file, replay_speed)
+        target = target or replay_file
+        due = 0.0
+        if pacer:
+            pacer.clock = lambda: replay.time               # Saved queries are counted by the recorded times
+            if pacer.budget:
+                pacer.budget.clock = lambda: replay.time    # The budget is refilled by the recorded times
+        while sample_count:
+            t0 = time.perf_counter()
+            try:
+                stats_raw = replay.command(command)
+            except EOFError:
+                break
+            if pacer:
+                if replay.time < due:
+                    continue                                # Not polled at the adaptive interval
+            t0 = lap('fetch', t0)
+            lines = [ln for ln in stats_raw.split('\n')[1:] if ln]
+            t0 = lap('parse', t0)
+            if not exporter:
+                print_header()
+                for ln in lines:
+                    print_line(ln)
+            t0 = lap('output', t0)
+            values = record(lines, replay.time)
+            lap('record', t0)
+            if pacer:
+                frequency = pacer.update(values)
+                due = replay.time + frequency - 0.5         # Recorded times jitter around the interval
+            if reporter:
+                instruments.count('samples')
+                instruments.count('requests')
+                instruments.count('bytes', len(stats_raw))
+                reporter.tick(pacer.counters if pacer else None)
+            sample_count -= 1
+        finish()
+
+    import svcdaemon
+
+    supervisor = svcdaemon.Supervisor() if daemon else None
+    backoff = svcdaemon.Backoff(ssh_backoff)
+    pool = svcdaemon.SessionPool(lambda: ssh_connect(target, user, password), ssh_alive, lambda client: client.close(),
+                                 svcdaemon.pool_size if daemon else 1)
+
+    if remote_loop:
+        # Like scstat.sh: the storage system samples itself, every header line starts a new sample in the stream
+        # and the empty line echoed after it ends the sample, so it is recorded without waiting for the next one
+        loop_command = 'while true; do {}; echo; sleep {}; done'.format(command, frequency)
+        samples = 0
+        while not handle_signals():
+            lines = []                                      # A sample cut by a broken stream is not complete
+            head = ''
+            try:
+                if not ssh_client:
+                    ssh_client = pool.get()
+                for ln in ssh_stream(loop_command, ssh_client, 2 * frequency + ssh_grace):
+                    is_header = ln.startswith('stat_name' + delimiter_svc)
+                    if lines and (is_header or not ln):
+                        t0 = time.perf_counter()
+                        record(lines)
+                        lap('record', t0)
+                        if recorder:
+                            recorder.command(command, '\n'.join([head] + lines) + '\n')
+                        if reporter:
+                            instruments.count('samples')
+                            instruments.count('bytes', sum(map(len, lines)) + len(head))
+                            reporter.tick()
+                        backoff.reset()
+                        lines = []
+                        if samples == sample_count or supervisor and supervisor.signalled():
+                            break
+                    if is_header:
+                        head = ln
+                        if samples == sample_count or supervisor and supervisor.signalled():
+                            break
+                        if supervisor:
+                            keepalive(user)
+                        samples += 1
+                        if not exporter:
+                            print_header()
+                    elif ln and samples:
+                        lines.append(ln)
+                        if not exporter:
+                            print_line(ln)
                 else:
-                    # We want nice stat format
-                    peak_time = time.strftime('%y-%m-%d %H:%M:%S', time.strptime(stats[3], '%y%m%d%H%M%S'))
-                    print('{0:19s}{1:>12s}{2:>12s}{3:>18s}'.format(stats[0], stats[1], stats[2], peak_time), flush=True)
+                    raise RuntimeError('The sampling loop has ended')
+            except Exception as err:
+                session_failed(err, user)
+                continue
+            if samples == sample_count:
+                break
+            drop_session()                                  # Stop the remote loop, a new one is started if reloading
+        finish()
+
+    deadline = time.monotonic()
+    while not handle_signals():
+        t0 = time.perf_counter()
+        try:
+            if not ssh_client:
+                ssh_client = pool.get()
+            stats_raw = ssh_exec(command, ssh_client)
+        except Exception as err:
+            session_failed(err, user)
+            continue
+        backoff.reset()
+        t0 = lap('fetch', t0)
+        if recorder:
+            recorder.command(command, stats_raw)
+
+        lines = [ln for ln in stats_raw.split('\n')[1:] if ln]
+        t0 = lap('parse', t0)
+        if not exporter:
+            print_header()
+            for ln in lines:
+                print_line(ln)
+        t0 = lap('output', t0)
+        values = record(lines)
+        lap('record', t0)
+
+        if reporter:
+            instruments.count('samples')
+            instruments.count('requests')
+            instruments.count('bytes', len(stats_raw))
+            late = int((time.monotonic() - deadline) // frequency)
+            if late > 0:
+                instruments.count('skipped', late)          # Polls planned while this one was running
+            reporter.tick(pacer.counters if pacer else None)
+        if pacer:
+            frequency = pacer.update(values)
+
+        sample_count -= 1
+        if not sample_count:
+            break
+
+        # Keep the period on the monotonic clock, so the time spent on the query and output causes no drift
+        deadline = max(deadline + frequency, time.monotonic())
+        if supervisor:
+            supervisor.wait(deadline, lambda: keepalive(user))
+        else:
+            time.sleep(max(0.0, deadline - time.monotonic()))
+
+    finish()
 
-    sample_count -= 1
-    if not sample_count:
-        sys.exit(0)
 
-    time.sleep(frequency)
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,23 @@ from setuptools import setup
 setup(
     name='svcstats.py',
     version='1.0.1.2',
-    py_modules=['svcstats'],
+    py_modules=['svcstats', 'svchist', 'svcexport', 'svcreplay', 'svcinstr', 'svcdaemon', 'svcalert', 'svcstore',
+                'svcpace', 'svcpipe', 'scstat_ssh'],
     install_requires=['pywbem'],
+    extras_require={'ssh': ['paramiko']},
+    entry_points={
+        'console_scripts': [
+            'svcstats = svcstats:main',
+            'scstat_ssh = scstat_ssh:main',
+            'svchist = svchist:main',
+            'svcexport = svcexport:main',
+            'svcreplay = svcreplay:main',
+            'svcinstr = svcinstr:main',
+            'svcalert = svcalert:main',
+            'svcstore = svcstore:main',
+            'svcpipe = svcpipe:main',
+        ]
+    },
     url='https://github.com/mezantrop/svcstats.py',
     license='',
     author='Mikhail Zakharov',
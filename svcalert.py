@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# Streaming anomaly detection for IBM SVC/Storwize collectors
+#
+# Every watched metric of every instance has an exponentially weighted moving average and variance, two floats
+# updated once per delta. A value further than 'sigma' standard deviations from the average, and more than the
+# metric floor or 'relative' part of the average away from it, raises an alert in the same interval. The metric
+# columns of a table are updated as whole columns with C level map() calls, only the rows over the variance limit
+# are looked at one by one, so the cost is linear in the number of instances.
+#
+# Usage:
+#   svcalert.py bench [instances [columns [intervals]]]
+# Runs the detector on synthetic tables of 'instances' (default 10000) rows and 'columns' (default 13) metrics
+# for 'intervals' (default 20) deltas with injected spikes and reports the time per interval and detected spikes
+
+
+import json
+import math
+import operator
+import random
+import sys
+import time
+from itertools import compress, repeat
+
+
+alpha = 0.1                                     # EWMA weight of a new value, about the last 20 intervals count
+sigma = 4.0                                     # Standard deviations from the average to raise an alert
+warmup = 10                                     # Deltas per instance before its alerts are raised
+relative = 0.25                                 # Smallest alerting deviation as a part of the average
+
+# Delta columns to watch and the smallest deviation worth an alert, lssystemstats fields use 'default_floor'
+watched = {'ms/rIO': 2.0, 'ms/wIO': 2.0, 'tIO/s': 100.0}
+default_floor = 1.0
+
+
+class Baseline:
+    """EWMA averages and variances of the 'metrics' of the instances of one table, e.g. the delta of a class of
+    a storage system. State is kept in a list per metric aligned with the rows of the last table. Variances are
+    kept multiplied by sigma squared, so they are compared with squared deviations as they are"""
+
+    def __init__(self, metrics, floors=()):
+        self.metrics = list(metrics)
+        self.floors = [dict(floors).get(metric, default_floor) for metric in self.metrics]
+        self.limit = sigma * sigma
+        self.ids = []
+        self.mean = [[] for metric in self.metrics]
+        self.var = [[] for metric in self.metrics]              # Variance times 'limit'
+        self.born = []                          # Update number of the first value of an instance
+        self.updates = 0
+
+    def _align(self, ids, columns):
+        """Move the state to the rows of 'ids', new instances start with their current values and no variance"""
+
+        index = {inst: r for r, inst in enumerate(self.ids)}
+        rows = [index.get(inst) for inst in ids]
+        for m, col in enumerate(columns):
+            mean, var = self.mean[m], self.var[m]
+            self.mean[m] = [col[n] if r is None else mean[r] for n, r in enumerate(rows)]
+            self.var[m] = [0.0 if r is None else var[r] for r in rows]
+        self.born = [self.updates if r is None else self.born[r] for r in rows]
+        self.ids = list(ids)
+
+    def update(self, ids, columns):
+        """Add a table of 'columns', one sequence of values per metric in the row order of 'ids'.
+        Returns [(row, metric, value, average, standard deviation), ...] of the values out of the baseline"""
+
+        if list(ids) != self.ids:
+            self._align(ids, columns)
+        self.updates += 1
+        ripe = self.updates - warmup
+        keep, add = 1.0 - alpha, alpha * (1.0 - alpha) * self.limit
+
+        result = []
+        for m, col in enumerate(columns):
+            mean, var = self.mean[m], self.var[m]
+            diff = list(map(operator.sub, col, mean))
+            square = list(map(operator.mul, diff, diff))
+            if any(map(operator.gt, square, var)):
+                floor = self.floors[m]
+                for r in compress(range(len(diff)), map(operator.gt, square, var)):
+                    if self.born[r] <= ripe and abs(diff[r]) > max(floor, relative * abs(mean[r])):
+                        result.append((r, self.metrics[m], col[r], mean[r], math.sqrt(var[r] / self.limit)))
+            self.mean[m] = list(map(operator.add, mean, map(operator.mul, diff, repeat(alpha))))
+            self.var[m] = list(map(operator.add, map(operator.mul, var, repeat(keep)),
+                                   map(operator.mul, square, repeat(add))))
+        return result
+
+
+class Detector:
+    """Baselines of all the tables of a collector. Alerts are appended to the 'filename' as JSON lines and printed
+    to stderr"""
+
+    def __init__(self, filename=''):
+        self.baselines = {}
+        self.file = open(filename, 'a') if filename else None
+        self.alerts = 0
+
+    def check(self, key, sample, labels=()):
+        """Update the baseline 'key', e.g. (target, table name), with the watched columns of a delta Sample.
+        Returns the alert events"""
+
+        names = sample.header[2:]
+        metrics = [metric for metric in watched if metric in names]
+        if not metrics or not len(sample):
+            return []
+        columns = [sample.column(names.index(metric)) for metric in metrics]
+        return self._update(key, metrics, sample.ids, columns, sample.time, labels)
+
+    def check_values(self, key, values, labels=()):
+        """Update the baseline 'key' with a {name: value} dictionary, e.g. lssystemstats output"""
+
+        metrics = sorted(values)
+        return self._update(key, metrics, ['system'], [[values[metric]] for metric in metrics],
+                            time.strftime('%Y-%m-%d %H:%M:%S'), labels)
+
+    def _update(self, key, metrics, ids, columns, sample_time, labels):
+        baseline = self.baselines.get(key)
+        if baseline is None or baseline.metrics != metrics:
+            baseline = self.baselines[key] = Baseline(metrics, watched)
+
+        events = []
+        for r, metric, value, mean, std in baseline.update(ids, columns):
+            event = dict(labels)
+            event.update({'time': sample_time, 'id': ids[r], 'metric': metric, 'value': round(value, 3),
+                          'mean': round(mean, 3), 'std': round(std, 3)})
+            events.append(event)
+        self.alerts += len(events)
+        self.emit(events)
+        return events
+
+    def emit(self, events):
+        for event in events:
+            print('Alert! {}'.format(' '.join('{}={}'.format(k, v) for k, v in event.items())), file=sys.stderr)
+            if self.file:
+                self.file.write(json.dumps(event) + '\n')
+        if self.file and events:
+            self.file.flush()
+
+
+def bench(instances=10000, columns=13, intervals=20, spikes=10):
+    """Feed synthetic tables with 'spikes' injected values per interval after the warm up into a Baseline.
+    Returns the seconds per interval, the number of injected and detected spikes and other alerts"""
+
+    metrics = ['m{}'.format(c) for c in range(columns)]
+    baseline = Baseline(metrics, dict.fromkeys(metrics, 1.0))
+    levels = [random.uniform(10, 1000) for inst in range(instances)]
+    ids = list(range(instances))
+
+    spent = []
+    injected = detected = other = 0
+    for interval in range(intervals):
+        table = [[lvl * random.gauss(1.0, 0.05) for lvl in levels] for metric in metrics]
+        expected = set()
+        if interval >= warmup:
+            for spike in range(spikes):
+                r, c = random.randrange(instances), random.randrange(columns)
+                table[c][r] *= 3
+                expected.add((r, metrics[c]))
+        t0 = time.perf_counter()
+        alerts = baseline.update(ids, table)
+        spent.append(time.perf_counter() - t0)
+        found = {(r, metric) for r, metric, value, mean, std in alerts}
+        injected += len(expected)
+        detected += len(found & expected)
+        other += len(found - expected)
+    return spent, injected, detected, other
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != 'bench':
+        print('Usage:\n\tsvcalert.py bench [instances [columns [intervals]]]', file=sys.stderr)
+        sys.exit(1)
+
+    args = [int(arg) for arg in sys.argv[2:5]]
+    instances, columns, intervals = args + [10000, 13, 20][len(args):]
+    spent, injected, detected, other = bench(instances, columns, intervals)
+    spent.sort()
+    print('{} instances x {} columns, {} intervals'.format(instances, columns, intervals))
+    print('update  median {:.2f} ms  max {:.2f} ms  {:.3f} us per value'.format(
+        spent[len(spent) // 2] * 1000, spent[-1] * 1000, spent[len(spent) // 2] * 1e6 / instances / columns))
+    print('spikes  {} injected  {} detected  {} other alerts'.format(injected, detected, other))
+
+
+if __name__ == '__main__':
+    main()
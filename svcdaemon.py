@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# Supervision of long-running IBM SVC/Storwize collectors
+#
+# A daemon collector keeps a small pool of authenticated sessions per storage system: the session in use and
+# standby sessions which are health checked while waiting for the next poll, so a broken session is replaced at
+# once and the sample of the interval is not lost. If no session works, the collector reconnects with an
+# exponentially growing delay and keeps its last samples, so the first delta after the outage is still valid.
+# SIGHUP asks to reload the configuration and reopen the sessions, SIGTERM and SIGINT to finish the sample in
+# flight and exit. The signals only set flags checked between samples.
+
+
+import os
+import random
+import select
+import signal
+import time
+
+
+pool_size = 2                                   # Sessions per storage system: the one in use and a standby
+health_interval = 60                            # Seconds between health checks of a standby session
+health_margin = 10                              # Seconds before a poll to run the health checks
+backoff_first = 5                               # First reconnect delay, seconds, doubled on each failure
+backoff_limit = 600                             # Longest reconnect delay, seconds
+
+
+class Backoff:
+    """Exponential reconnect delays: 'first' seconds doubled on each failure up to 'limit', with a random jitter
+    of up to a half, so collectors that lost the same storage system do not reconnect all at once"""
+
+    def __init__(self, first=backoff_first, limit=backoff_limit):
+        self.first = first
+        self.limit = limit
+        self.failures = 0
+
+    def delay(self):
+        """Account a failure and return the seconds to wait before the next attempt"""
+        self.failures += 1
+        delay = min(self.first * 2 ** (self.failures - 1), self.limit)
+        return delay * random.uniform(0.5, 1.0)
+
+    def reset(self):
+        self.failures = 0
+
+
+class SessionPool:
+    """Up to 'size' sessions of one storage system: the one taken with get() and standby ones. 'connect' opens an
+    authenticated session, 'check' raises or returns False if a session does not work, 'close' closes it.
+    Not thread safe, a pool belongs to one collector"""
+
+    def __init__(self, connect, check, close, size=pool_size):
+        self.connect = connect
+        self.check = check
+        self.close_session = close
+        self.size = size
+        self.idle = []                          # [session, monotonic time of the last health check]
+        self.busy = 0
+
+    def get(self):
+        """Return the most recently checked standby session or open a new one"""
+        session = self.idle.pop()[0] if self.idle else self.connect()
+        self.busy += 1
+        return session
+
+    def discard(self, session):
+        """Close a broken session taken with get()"""
+        self.busy -= 1
+        self._close(session)
+
+    def refresh(self):
+        """Health check the standby sessions, close the dead ones and open new ones up to the pool 'size'. New
+        sessions are checked before they are kept, errors of opening them are raised"""
+
+        now = time.monotonic()
+        for entry in list(self.idle):
+            if now - entry[1] < health_interval:
+                continue
+            try:
+                alive = self.check(entry[0])
+            except Exception:
+                alive = False
+            if alive:
+                entry[1] = now
+            else:
+                self.idle.remove(entry)
+                self._close(entry[0])
+
+        while self.busy + len(self.idle) < self.size:
+            session = self.connect()
+            try:
+                if not self.check(session):
+                    raise RuntimeError('A new session does not respond')
+            except Exception:
+                self._close(session)
+                raise
+            self.idle.insert(0, [session, time.monotonic()])
+
+    def close(self):
+        """Close the standby sessions"""
+        while self.idle:
+            self._close(self.idle.pop()[0])
+
+    def _close(self, session):
+        try:
+            self.close_session(session)
+        except Exception:
+            pass                                # It is broken anyway
+
+
+class Supervisor:
+    """Turn SIGHUP into a 'reload' request, SIGTERM and SIGINT into a 'stop' request. sleep() returns as soon as a
+    signal arrives. Must be created in the main thread"""
+
+    def __init__(self):
+        self.reload = False
+        self.stop = False
+
+        # The C level handler writes the signal number into the pipe, so a select() on it wakes up at once
+        self.wakeup, writer = os.pipe()
+        os.set_blocking(self.wakeup, False)
+        os.set_blocking(writer, False)
+        signal.set_wakeup_fd(writer)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._handler)
+
+    def _handler(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self.reload = True
+        else:
+            self.stop = True
+
+    def signalled(self):
+        return self.reload or self.stop
+
+    def reloading(self):
+        """Return True once per SIGHUP"""
+        reload, self.reload = self.reload, False
+        return reload
+
+    def sleep(self, seconds):
+        """Sleep up to 'seconds', return early if a signal is pending or arrives"""
+        deadline = time.monotonic() + seconds
+        while not self.signalled():
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            select.select([self.wakeup], [], [], timeout)
+            try:
+                os.read(self.wakeup, 64)
+            except BlockingIOError:
+                pass
+
+    def wait(self, deadline, keepalive=None):
+        """Sleep until the monotonic clock 'deadline'. Run 'keepalive', e.g. health checks of standby sessions,
+        'health_margin' seconds before it. Returns early on a signal"""
+
+        if keepalive:
+            self.sleep(deadline - health_margin - time.monotonic())
+            if not self.signalled():
+                keepalive()
+        self.sleep(deadline - time.monotonic())
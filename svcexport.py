@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+#
+# Prometheus/OpenMetrics text exporter for IBM SVC/Storwize collectors
+#
+# The collectors publish their tables once per collection interval. Each table is rendered into text right away
+# and only the metrics it changed are rebuilt. The response body is joined once per change and cached, so a scrape
+# only sends ready bytes and never waits for the storage system, no matter how many scrapers or targets there are.
+#
+# Usage:
+#   svcexport.py bench [instances [scrapers]]
+# Publishes a synthetic vdisk delta table of 'instances' (default 1000) rows, about 11 series each, and scrapes it
+# with one and with 'scrapers' (default 8) concurrent clients, reporting the scrape latencies
+
+
+import bisect
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def metric_name(*parts):
+    """Build a valid metric name, e.g. ('svc', 'vdisk', 'ms/rIO') -> 'svc_vdisk_ms_per_rio'"""
+    name = '_'.join(parts).replace('/', '_per_').replace('%', '_pc').lower()
+    return re.sub('[^a-z0-9_]', '_', name)
+
+
+def label_string(labels):
+    return ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+
+
+def render_sample(prefix, sample, labels=(), skip=()):
+    """Render a Sample table: one gauge per column except the 'skip' ones, one series per InstanceID labeled with
+    'id' and 'labels'. Returns {metric name: series text}"""
+
+    common = label_string(labels)
+    if common:
+        common += ','
+    ids = ['{{{}id="{}"}} '.format(common, inst) for inst in sample.ids]
+
+    result = {}
+    for c, column in enumerate(sample.header[2:]):
+        if column in skip:
+            continue
+        name = metric_name(prefix, column)
+        result[name] = ''.join([name + lbl + repr(val) + '\n' for lbl, val in zip(ids, sample.column(c))])
+    return result
+
+
+def render_values(prefix, values, labels=()):
+    """Render a {name: value} dictionary, e.g. lssystemstats output, one gauge per name.
+    Returns {metric name: series text}"""
+
+    lbl = '{' + label_string(labels) + '} '
+    result = {}
+    for name, val in values.items():
+        name = metric_name(prefix, name)
+        result[name] = name + lbl + repr(val) + '\n'
+    return result
+
+
+class Exporter:
+    """Serve the latest published metrics on http://address:port/metrics from a background thread"""
+
+    def __init__(self, port, address=''):
+        self.sections = {}                                      # Section key: {metric name: encoded series}
+        self.metrics = {}                                       # Metric name: (sorted section keys, their series)
+        self.body = b''                                         # Cached response, None when it has to be joined
+        self.lock = threading.Lock()
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = exporter.payload()                           # Cached bytes, no rendering here
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass                                                # Keep stderr for the collector messages
+
+        self.server = ThreadingHTTPServer((address, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def publish(self, key, metrics):
+        """Replace the 'key' section, e.g. a (target, class) pair, with the rendered 'metrics'. Series of the same
+        metric coming from different sections are grouped under one TYPE line. Only the metrics of the old and the
+        new section are rebuilt, so a publish costs the same no matter how many other sections there are"""
+
+        series = {name: text.encode() for name, text in metrics.items()}
+        with self.lock:
+            old = self.sections.get(key, {})
+            self.sections[key] = series
+            for name in old.keys() - series.keys():
+                self._place(name, key, None)
+            for name, text in series.items():
+                self._place(name, key, text)
+            self.body = None
+
+    def remove(self, *keys):
+        """Drop the 'keys' sections, e.g. of a failed target, so their series go stale instead of repeating the last
+        values"""
+
+        with self.lock:
+            for key in keys:
+                for name in self.sections.pop(key, {}):
+                    self._place(name, key, None)
+            self.body = None
+
+    def _place(self, name, key, text):
+        """Put the 'text' series of the 'name' metric of the 'key' section in order among the other sections, or
+        take them out with None"""
+
+        keys, texts = self.metrics.setdefault(name, ([], []))
+        i = bisect.bisect_left(keys, str(key))
+        if i < len(keys) and keys[i] == str(key):
+            if text is None:
+                del keys[i], texts[i]
+            else:
+                texts[i] = text
+        elif text is not None:
+            keys.insert(i, str(key))
+            texts.insert(i, text)
+
+        if not keys:
+            del self.metrics[name]
+
+    def payload(self):
+        """Response body of all the metrics in name order, joined on the first scrape after a change"""
+
+        with self.lock:
+            if self.body is None:
+                body = []
+                for name in sorted(self.metrics):
+                    body.append('# TYPE {} gauge\n'.format(name).encode())
+                    body.extend(self.metrics[name][1])
+                self.body = b''.join(body)
+            return self.body
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench(instances=1000, scrapers=8, scrapes=50):
+    """Publish a synthetic vdisk delta table of 'instances' rows to an Exporter on a free local port and scrape it
+    'scrapes' times from each of 1 and 'scrapers' concurrent urllib clients. Returns the number of series, the body
+    size, the publish time in seconds and {clients: (sorted scrape latencies, scrapes per second)}"""
+
+    import random
+    import urllib.request
+    import svcstats
+    from array import array
+
+    cim_class = 'IBMTSSVC_StorageVolumeStatistics'
+    header = svcstats.headers[cim_class]['result']
+    delta = svcstats.Sample.from_columns(header, svcstats.datetime('20260101000000'), array('q', range(instances)),
+                                         [[random.random() * 10000 for inst in range(instances)] for c in header[2:]])
+    exporter = Exporter(0, '127.0.0.1')
+    url = 'http://127.0.0.1:{}/metrics'.format(exporter.server.server_address[1])
+
+    start = time.perf_counter()
+    metrics = svcstats.export_delta(svcstats.metric_prefixes[cim_class], delta, ['0000020060C00001', 'synthetic'])
+    exporter.publish(('synthetic', cim_class), metrics)
+    exporter.payload()
+    published = time.perf_counter() - start
+    series = sum(text.count('\n') for text in metrics.values())
+
+    def scrape(latencies):
+        for n in range(scrapes):
+            t0 = time.perf_counter()
+            with urllib.request.urlopen(url) as response:
+                response.read()
+            latencies.append(time.perf_counter() - t0)
+
+    results = {}
+    for clients in sorted({1, scrapers}):
+        latencies = []
+        threads = [threading.Thread(target=scrape, args=(latencies,)) for client in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[clients] = (sorted(latencies), len(latencies) / (time.perf_counter() - start))
+
+    exporter.close()
+    return series, len(exporter.payload()), published, results
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != 'bench':
+        print('Usage:\n\tsvcexport.py bench [instances [scrapers]]', file=sys.stderr)
+        sys.exit(1)
+
+    args = [int(arg) for arg in sys.argv[2:4]]
+    instances, scrapers = args + [1000, 8][len(args):]
+    series, size, published, results = bench(instances, scrapers)
+    print('{} series, {} KB body, rendered and published in {:.1f} ms'.format(series, size // 1024, published * 1000))
+    for clients, (latencies, rate) in results.items():
+        print('{:3d} scrapers  p50 {:.2f} ms  p99 {:.2f} ms  {:.0f} scrapes/s'.format(
+            clients, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000, rate))
+
+
+if __name__ == '__main__':
+    main()
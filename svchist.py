@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+#
+# Rolling performance statistics history for IBM SVC/Storwize collectors. A native replacement of the RRD
+# database created by 2rrd/2rrd_scstat-controller.sh
+#
+# The history is a memory-mapped file of fixed size. For every consolidation tier it keeps a ring buffer of
+# AVERAGE and MAX values per metric, the default tiers match the RRA layout of the 2rrd script:
+#   1440 rows of 1 step  = 24 hours with 1 minute resolution
+#    288 rows of 10 steps = 48 hours, 10 minute averages
+#    336 rows of 30 steps = 7 days, 30 minute averages
+# An update touches only the current row of each tier, so writes are O(1) per sample and a restart just maps the
+# file again.
+#
+# Usage:
+#   svchist.py file [metric [tier]]
+# Prints metric names of the history file or the AVERAGE and MAX values of the metric for the tier (default 0)
+
+
+import mmap
+import math
+import os
+import struct
+import sys
+import time
+
+
+magic = b'SVCHIST1'
+header_format = '<8sIII'                        # Magic, step in seconds, number of metrics, number of tiers
+header_size = 64
+name_size = 32                                  # Bytes per metric name
+default_step = 60
+default_tiers = ((1, 1440), (10, 288), (30, 336))   # (steps per row, rows) for each tier
+
+
+class History:
+    """Fixed-size ring buffer history of 'metrics' with AVERAGE/MAX consolidation 'tiers' kept in the 'filename'.
+    An existing file is opened as is, its metrics, step and tiers take precedence over the arguments"""
+
+    def __init__(self, filename, metrics=(), step=default_step, tiers=default_tiers):
+        if not os.path.exists(filename) or not os.path.getsize(filename):
+            self._create(filename, metrics, step, tiers)
+
+        self.file = open(filename, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+        hdr_magic, self.step, count, tier_count = struct.unpack_from(header_format, self.map)
+        if hdr_magic != magic:
+            raise ValueError('Not a history file: "{}"'.format(filename))
+
+        self.metrics = [
+            self.map[header_size + m * name_size:header_size + (m + 1) * name_size].rstrip(b'\0').decode()
+            for m in range(count)
+        ]
+        self.position = {name: m for m, name in enumerate(self.metrics)}
+
+        # Everything after the names is doubles: tier descriptors, accumulators and ring buffers
+        self.view = memoryview(self.map)
+        values = self.values = self.view[header_size + count * name_size:].cast('d')
+        self.tiers = []
+        offset = 0
+        for t in range(tier_count):
+            steps, rows = int(values[offset]), int(values[offset + 1])
+            tier = {
+                'steps': steps, 'rows': rows,
+                'state': values[offset + 2:offset + 3],                     # Index of the current row (cdp)
+                'count': values[offset + 3:offset + 3 + count],
+                'sum': values[offset + 3 + count:offset + 3 + count * 2],
+                'max': values[offset + 3 + count * 2:offset + 3 + count * 3],
+            }
+            offset += 3 + count * 3
+            tier['AVERAGE'] = values[offset:offset + rows * count]
+            offset += rows * count
+            tier['MAX'] = values[offset:offset + rows * count]
+            offset += rows * count
+            self.tiers.append(tier)
+
+    @staticmethod
+    def _create(filename, metrics, step, tiers):
+        """Write an empty history file: all ring buffers are NaN (unknown)"""
+
+        if not metrics:
+            raise ValueError('Metrics are required to create a history file')
+
+        count = len(metrics)
+        with open(filename, 'wb') as hist:
+            hist.write(struct.pack(header_format, magic, step, count, len(tiers)).ljust(header_size, b'\0'))
+            for name in metrics:
+                hist.write(name.encode()[:name_size].ljust(name_size, b'\0'))
+            for steps, rows in tiers:
+                hist.write(struct.pack('<3d', steps, rows, -1))
+                hist.write(struct.pack('<{}d'.format(count * 2), *[0.0] * count * 2))
+                hist.write(struct.pack('<d', -math.inf) * count)
+                hist.write(struct.pack('<d', math.nan) * rows * count * 2)
+
+    def close(self):
+        self.map.flush()
+        for tier in self.tiers:
+            for buf in tier.values():
+                if isinstance(buf, memoryview):
+                    buf.release()
+        self.tiers = []
+        self.values.release()
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+    def update(self, values, timestamp=None):
+        """Add a sample taken at 'timestamp' Epoch seconds, the current time by default. 'values' is a {metric:
+        value} dictionary, unknown metrics are ignored. Samples older than the current row of the finest tier are
+        dropped"""
+
+        if timestamp is None:
+            timestamp = time.time()
+        pdp = int(timestamp // self.step)                       # Primary data point index
+
+        known = [(self.position[name], float(val)) for name, val in values.items() if name in self.position]
+        count = len(self.metrics)
+
+        for tier in self.tiers:
+            cdp = pdp // tier['steps']                          # Consolidated data point index
+            state = tier['state']
+            if cdp < state[0]:
+                return                                          # Clock went back
+            if cdp > state[0]:
+                # A new row: mark skipped rows as unknown and reset the accumulators
+                if state[0] >= 0:
+                    for gap in range(int(state[0]) + 1, min(cdp, int(state[0]) + 1 + tier['rows'])):
+                        row = (gap % tier['rows']) * count
+                        for m in range(count):
+                            tier['AVERAGE'][row + m] = tier['MAX'][row + m] = math.nan
+                for m in range(count):
+                    tier['count'][m] = tier['sum'][m] = 0.0
+                    tier['max'][m] = -math.inf
+                state[0] = cdp
+
+            row = (cdp % tier['rows']) * count
+            for m, val in known:
+                tier['count'][m] += 1
+                tier['sum'][m] += val
+                tier['max'][m] = max(tier['max'][m], val)
+                tier['AVERAGE'][row + m] = tier['sum'][m] / tier['count'][m]
+                tier['MAX'][row + m] = tier['max'][m]
+
+    def fetch(self, metric, tier=0, cf='AVERAGE'):
+        """Return [(timestamp, value), ...] of the 'metric' for the 'tier' from the oldest to the newest row.
+        Unknown values are NaN"""
+
+        tr = self.tiers[tier]
+        m = self.position[metric]
+        cdp = int(tr['state'][0])
+        if cdp < 0:
+            return []
+
+        count = len(self.metrics)
+        return [
+            (k * tr['steps'] * self.step, tr[cf][(k % tr['rows']) * count + m])
+            for k in range(max(0, cdp - tr['rows'] + 1), cdp + 1)
+        ]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage:\n\tsvchist.py file [metric [tier]]', file=sys.stderr)
+        sys.exit(1)
+
+    history = History(sys.argv[1])
+    if len(sys.argv) < 3:
+        print('\n'.join(history.metrics))
+    else:
+        tier = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+        for (ts, avg), (ts, peak) in zip(history.fetch(sys.argv[2], tier), history.fetch(sys.argv[2], tier, 'MAX')):
+            if not math.isnan(avg):
+                print(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts)), avg, peak)
+    history.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+#
+# Self-instrumentation of IBM SVC/Storwize collectors
+#
+# Every stage of a collection interval (CIMOM requests, decoding, delta, output...) is timed into a latency histogram
+# with HDR-style fixed buckets: values up to 64 microseconds are exact, above that each power of two is split into 32
+# buckets, so any value is kept with about 3% precision in a fixed 928-counter array. Recording is a bit_length(),
+# a shift and an increment, no allocation and no sorting. Counters track instances, bytes, requests and retries.
+# Collectors print a summary line and/or append a JSON snapshot per reporting period.
+#
+# Usage:
+#   svcinstr.py file
+# Prints the JSON snapshots of the file as summary lines
+
+
+import json
+import sys
+import threading
+import time
+from array import array
+
+
+sub_bits = 5                                    # 32 sub-buckets per power of two
+max_bits = 33                                   # Values up to 2^33 microseconds, about 2.4 hours
+quantiles = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """Latency histogram of microsecond values in log-linear fixed buckets"""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    size = (max_bits - sub_bits + 1) << sub_bits
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * self.size))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        usec = int(seconds * 1000000)
+        if usec < 2 << sub_bits:
+            idx = max(usec, 0)
+        else:
+            shift = usec.bit_length() - sub_bits - 1
+            idx = min((shift << sub_bits) + (usec >> shift), self.size - 1)
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @staticmethod
+    def value(idx):
+        """Middle of the bucket 'idx' in seconds"""
+        if idx < 2 << sub_bits:
+            return idx / 1000000
+        shift = (idx >> sub_bits) - 1
+        return (((idx - (shift << sub_bits)) << shift) + (1 << shift) / 2) / 1000000
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for idx, cnt in enumerate(self.counts):
+            seen += cnt
+            if cnt and seen >= rank:
+                return min(self.value(idx), self.max)
+        return self.max
+
+    def snapshot(self):
+        result = {'count': self.count, 'mean': self.total / self.count if self.count else 0.0, 'max': self.max}
+        result.update(('p{:g}'.format(q * 100), self.quantile(q)) for q in quantiles)
+        return result
+
+
+class Instruments:
+    """Stage latency histograms and counters of a collector, shared by its threads"""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {'instances': 0, 'requests': 0, 'bytes': 0, 'errors': 0}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = Histogram()
+            hist.record(seconds)
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def snapshot(self, extra=None):
+        """Machine-readable state: time, counters updated with the 'extra' ones and stage histogram summaries"""
+        with self.lock:
+            counters = dict(self.counters)
+            counters.update(extra or {})
+            return {'time': time.time(), 'counters': counters,
+                    'stages': {stage: hist.snapshot() for stage, hist in self.stages.items()}}
+
+    def summary(self, extra=None):
+        return summary_line(self.snapshot(extra))
+
+
+def summary_line(snapshot):
+    """One line of counters and 'stage p50/p90/p99/max ms' per stage"""
+    line = ' '.join('{} {}'.format(name, val) for name, val in snapshot['counters'].items())
+    for stage, hist in snapshot['stages'].items():
+        line += '; {} {}'.format(stage, '/'.join('{:.1f}'.format(hist[k] * 1000) for k in ('p50', 'p90', 'p99', 'max')))
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['time'])) + ' ' + line + ' ms'
+
+
+class Reporter:
+    """Write a summary line to stderr and/or a JSON line to the 'filename' every 'period' seconds"""
+
+    def __init__(self, instruments, period, filename='', text=True):
+        self.instruments = instruments
+        self.period = period
+        self.text = text
+        self.filename = filename
+        self.file = open(filename, 'a') if filename else None
+        self.next = time.monotonic() + period
+
+    def reopen(self):
+        """Open the file again, e.g. after it was rotated"""
+        if self.file:
+            self.file.close()
+            self.file = open(self.filename, 'a')
+
+    def tick(self, extra=None, force=False):
+        """Report if the period is over or if 'force'd, e.g. on exit. 'extra' are counters kept elsewhere, e.g.
+        Scheduler counters"""
+        now = time.monotonic()
+        if now < self.next and not force:
+            return
+        self.next = max(self.next + self.period, now)
+        snapshot = self.instruments.snapshot(extra)
+        if self.text:
+            print(summary_line(snapshot), file=sys.stderr, flush=True)
+        if self.file:
+            self.file.write(json.dumps(snapshot) + '\n')
+            self.file.flush()
+
+
+def operation_probe(connection, instruments):
+    """Attach a pywbem operation recorder to the 'connection' which times every CIM operation, pull operations page
+    by page, into the 'cimom' histogram, the server response time reported by the CIMOM into 'server', and counts
+    requests, received bytes and failed operations"""
+
+    import pywbem
+
+    class Probe(pywbem.BaseOperationRecorder):
+        def record(self, pywbem_args, pywbem_result, http_request, http_response):
+            instruments.count('requests')
+            instruments.count('bytes', connection.last_reply_len or 0)
+            if pywbem_result.exc is not None:
+                instruments.count('errors')
+            if connection.last_operation_time is not None:
+                instruments.record('cimom', connection.last_operation_time)
+            if connection.last_server_response_time is not None:
+                instruments.record('server', connection.last_server_response_time)
+
+    connection.statistics.enable()                      # Operation times are measured by the statistics timer
+    connection.add_operation_recorder(Probe())
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage:\n\tsvcinstr.py file', file=sys.stderr)
+        sys.exit(1)
+
+    with open(sys.argv[1]) as stream:
+        for ln in stream:
+            print(summary_line(json.loads(ln)))
+
+
+if __name__ == '__main__':
+    main()
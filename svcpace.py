@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+#
+# Adaptive polling of IBM SVC/Storwize collectors
+#
+# A collector polls at the slowest interval while the storage system is quiet. When a watched lssystemstats value
+# crosses its threshold or changes quickly between two samples, it switches at once to the fastest interval, and
+# doubles the interval back after every 'pace_relax' quiet samples. Polls faster than the slowest interval take a
+# token from a query budget, a token bucket optionally shared by all the collectors of a host through a locked
+# file, so an incident on many systems at once can't overload the management network. The queries saved against
+# fixed polling at the fastest interval are counted.
+
+
+import struct
+import time
+
+
+# lssystemstats values to watch: (threshold to poll fast at or None, smallest change between samples to react on)
+pace_watched = {
+    'cpu_pc': (70.0, 10.0),
+    'write_cache_pc': (80.0, 10.0),
+    'total_cache_pc': (None, 10.0),
+    'vdisk_ms': (10.0, 2.0),
+    'vdisk_r_ms': (10.0, 2.0),
+    'vdisk_w_ms': (10.0, 2.0),
+    'mdisk_ms': (20.0, 5.0),
+    'drive_ms': (20.0, 5.0),
+    'vdisk_io': (None, 2000.0),
+    'vdisk_mb': (None, 200.0),
+}
+pace_change = 0.5                               # Change between samples to react on as a part of the last value
+pace_relax = 5                                  # Quiet samples before the interval is doubled
+budget_burst = 600                              # Seconds of the budget rate a collector may spend at once
+
+
+class Budget:
+    """Token bucket of 'rate' queries per hour. With a 'filename' the bucket is kept in the file and shared by all
+    the collectors using it, the file is locked while a token is taken. 'clock' returns the epoch seconds, e.g. the
+    recorded times of a replay"""
+
+    state = struct.Struct('<dd')                # Tokens, wall clock time of the last refill
+
+    def __init__(self, rate, filename='', clock=time.time):
+        self.rate = rate / 3600
+        self.capacity = max(self.rate * budget_burst, 1.0)
+        self.filename = filename
+        self.clock = clock
+        self.tokens = self.capacity
+        self.stamp = None
+
+    def _take(self, force):
+        now = self.clock()
+        if self.stamp is None:
+            self.stamp = now
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.stamp) * self.rate)
+        self.stamp = max(now, self.stamp)                # Collectors of a shared budget may lag behind
+        if self.tokens < 1 and not force:
+            return False
+        self.tokens -= 1                        # Forced polls may run into debt, paid back before any fast poll
+        return True
+
+    def take(self, force=False):
+        """Take a token for a query, return False if there is none. A 'force'd query is always accounted"""
+
+        if not self.filename:
+            return self._take(force)
+
+        import fcntl
+
+        with open(self.filename, 'a+b') as stream:
+            fcntl.flock(stream, fcntl.LOCK_EX)
+            stream.seek(0)
+            data = stream.read(self.state.size)
+            if len(data) == self.state.size:
+                self.tokens, self.stamp = self.state.unpack(data)
+            else:
+                self.tokens, self.stamp = self.capacity, None           # A new or cut file
+            result = self._take(force)
+            stream.seek(0)
+            stream.truncate()
+            stream.write(self.state.pack(self.tokens, self.stamp))
+            return result                       # The lock is released on close
+
+
+class Pacer:
+    """Polling interval between 'fastest' and 'slowest' seconds driven by the samples. 'budget' is a Budget or None
+    for unlimited fast polls. 'clock' returns the seconds the saved queries are counted by, e.g. the recorded times
+    of a replay"""
+
+    def __init__(self, fastest, slowest, budget=None, clock=time.monotonic):
+        self.fastest = fastest
+        self.slowest = slowest
+        self.budget = budget
+        self.clock = clock
+        self.stamp = None                       # Time of the last poll
+        self.interval = slowest
+        self.quiet = 0
+        self.last = {}
+        self.counters = {'polls': 0, 'saved': 0, 'fast': 0, 'throttled': 0}
+
+    def hot(self, values):
+        """Names of the watched values over their thresholds or changed quickly since the last sample"""
+
+        result = []
+        for name, (threshold, floor) in pace_watched.items():
+            value = values.get(name)
+            if value is None:
+                continue
+            last = self.last.get(name)
+            if threshold is not None and value >= threshold or \
+                    last is not None and abs(value - last) > max(floor, pace_change * abs(last)):
+                result.append(name)
+        self.last = values
+        return result
+
+    def update(self, values):
+        """Account the poll of a sample {name: value} and return the seconds to the next one"""
+
+        # The fastest interval polls skipped since the last poll. Rounded, as the polls jitter around the interval
+        now = self.clock()
+        if self.stamp is not None:
+            self.counters['saved'] += max(0, round((now - self.stamp) / self.fastest) - 1)
+        self.stamp = now
+
+        if self.hot(values):
+            self.interval = self.fastest
+            self.quiet = 0
+            self.counters['fast'] += 1
+        else:
+            self.quiet += 1
+            if self.quiet >= pace_relax:
+                self.interval = min(self.interval * 2, self.slowest)
+                self.quiet = 0
+
+        if self.budget:
+            if self.interval < self.slowest and not self.budget.take():
+                self.interval = self.slowest
+                self.counters['throttled'] += 1
+            elif self.interval >= self.slowest:
+                self.budget.take(force=True)
+
+        self.counters['polls'] += 1
+        return self.interval
+
+    def summary(self):
+        return 'Adaptive polling: {polls} queries, {saved} saved against polling every {fastest} seconds, ' \
+               '{fast} fast, {throttled} throttled by the budget'.format(fastest=self.fastest, **self.counters)
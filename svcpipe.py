@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+#
+# Staged collection pipeline of IBM SVC/Storwize statistics
+#
+# A poll runs as four stages connected by bounded queues: fetch (CIM pull operations, a page of instances at a
+# time), decode (field extraction into the compact Sample), delta (build_delta() and rollups) and sink (output).
+# Every stage has its own thread, so the CIMOM round trips of the next page or class overlap the decoding and the
+# output of the previous ones. A full queue blocks the stage feeding it, so at most 'pipe_depth' pages or tables
+# wait between two stages whatever the class size. Large classes may be fetched and decoded in worker processes
+# instead, one per class with its own connection: parsing does not compete with the other stages for the GIL, and
+# only the compact Sample arrays come back, parsed instances never cross the process boundary.
+#
+# Usage:
+#   svcpipe.py bench file [latency_ms [depth]]
+# Replays the log as fast as possible, spending 'latency_ms' (default 20) per page of instances to stand for the
+# network, and reports the interval latency from the first request to the last table written of the serial loop,
+# the pipeline and the pipeline with worker processes
+
+
+import pickle
+import queue
+import signal
+import sys
+import threading
+import time
+from itertools import islice
+
+
+pipe_depth = 4                                  # Pages or tables waiting between two stages
+
+# Classes fetched and decoded in worker processes with -Q, the ones with thousands of instances
+process_classes = ('IBMTSSVC_StorageVolumeStatistics', 'IBMTSSVC_BackendVolumeStatistics',
+                   'IBMTSSVC_DiskDriveStatistics')
+
+_stop = object()                                # End of a poll in a queue
+
+
+class Pipeline:
+    """Run the polls of a svcstats.Collector through the fetch, decode, delta and sink stages. The classes of the
+    'workers' dictionary are fetched by their ClassWorker processes"""
+
+    def __init__(self, collector, depth=pipe_depth, workers=None):
+        self.collector = collector
+        self.depth = depth
+        self.workers = workers or {}
+        self.error = None
+        self.abort = threading.Event()          # Stop fetching: a stage failed or the sample is not a new one
+
+    def poll(self, sink):
+        """Collect all the selected classes once and call sink(name, prefix, table, first) for every output table
+        of Collector.accept() as soon as it is ready, in the calling thread. Returns the number of tables. An error
+        of any stage is raised once all the stages have stopped"""
+
+        import svcstats
+
+        collector = self.collector
+        start = collector.begin()
+        self.error = None
+        self.abort.clear()
+
+        for cim_class, worker in self.workers.items():
+            if cim_class in collector.cim_classes:
+                worker.request()                # The worker processes fetch their classes at the same time
+        pages, samples, tables = (queue.Queue(self.depth) for stage in range(3))
+        threads = [threading.Thread(target=self._fetch, args=(pages,), daemon=True),
+                   threading.Thread(target=self._decode, args=(pages, samples), daemon=True),
+                   threading.Thread(target=self._delta, args=(samples, tables), daemon=True)]
+        for thread in threads:
+            thread.start()
+
+        count = 0
+        spent = 0.0
+        for table in iter(tables.get, _stop):
+            if self.error:
+                continue                        # Drain, so the stages feeding the queue are not blocked
+            try:
+                t0 = time.perf_counter()
+                sink(*table)
+                spent += time.perf_counter() - t0
+                count += 1
+            except Exception as err:
+                self._fail(err)
+        for thread in threads:
+            thread.join()
+        for worker in self.workers.values():
+            worker.discard()                    # Not fetched, as the poll stopped early: the reply is stale
+
+        if self.error:
+            raise self.error
+        collector.settle(start)
+        if collector.instruments and count:
+            collector.instruments.record('output', spent)
+        return count
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.close()
+
+    def _fail(self, err):
+        if self.error is None:
+            self.error = err
+        self.abort.set()
+
+    def _fetch(self, out):
+        """Fetch stage: pages of instances of every class, then an end mark, or the Sample of a ClassWorker"""
+
+        try:
+            for cim_class in list(self.collector.cim_classes):
+                if self.abort.is_set():
+                    break
+                worker = self.workers.get(cim_class)
+                if worker:
+                    t0 = time.perf_counter()
+                    sample = worker.fetch()
+                    if self.collector.instruments:
+                        self.collector.instruments.record('fetch', time.perf_counter() - t0)
+                    out.put((cim_class, 'sample', sample))
+                else:
+                    self._fetch_pages(cim_class, out)
+        except Exception as err:
+            self._fail(err)
+        finally:
+            out.put(_stop)
+
+    def _fetch_pages(self, cim_class, out):
+        """Pull the instances of the 'cim_class' page by page. Like Collector.fetch() the request is retried once
+        on a standby session, unless a page has already been passed on"""
+
+        import svcstats
+
+        collector = self.collector
+        request = svcstats.stats_query(cim_class, svcstats.headers[cim_class]['request'])
+        for attempt in range(2):
+            fetch = 0.0
+            instances = 0
+            try:
+                t0 = time.perf_counter()
+                stats = collector.connection.IterQueryInstances(svcstats.query_language, request,
+                                                                MaxObjectCount=svcstats.page_size).generator
+                page = list(islice(stats, svcstats.page_size))
+                while page:
+                    fetch += time.perf_counter() - t0
+                    instances += len(page)
+                    out.put((cim_class, 'page', page))
+                    if self.abort.is_set():
+                        return
+                    t0 = time.perf_counter()
+                    page = list(islice(stats, svcstats.page_size))
+                fetch += time.perf_counter() - t0
+                break
+            except Exception:
+                if attempt or instances or not collector.pool or not collector.pool.idle:
+                    raise
+            collector.pool.discard(collector.connection)
+            collector.connection = collector.pool.get()
+            if collector.instruments:
+                collector.instruments.count('retries')
+
+        if collector.instruments:
+            collector.instruments.record('fetch', fetch)
+            collector.instruments.count('instances', instances)
+        out.put((cim_class, 'end', None))
+
+    def _decode(self, inp, out):
+        """Decode stage: decode the pages into a Sample per class, pass it on at the end of the class"""
+
+        import svcstats
+
+        current = {}
+        spent = {}
+        for item in iter(inp.get, _stop):
+            if self.error:
+                continue
+            cim_class, kind, payload = item
+            try:
+                t0 = time.perf_counter()
+                if kind == 'page':
+                    sample = current.get(cim_class)
+                    if sample is None:
+                        sample = current[cim_class] = svcstats.Sample(svcstats.headers[cim_class]['result'])
+                    decode = svcstats.row_decoder(cim_class, svcstats.headers[cim_class]['request'])
+                    sample.extend(map(decode, payload))
+                    spent[cim_class] = spent.get(cim_class, 0.0) + time.perf_counter() - t0
+                    continue
+                if kind == 'end':
+                    payload = current.pop(cim_class, None)
+                    if self.collector.instruments:
+                        self.collector.instruments.record('decode', spent.pop(cim_class, 0.0))
+                out.put((cim_class, payload if payload else None))
+            except Exception as err:
+                self._fail(err)
+        out.put(_stop)
+
+    def _delta(self, inp, out):
+        """Delta stage: Collector.accept() of every Sample, its output tables are passed on one by one"""
+
+        stale = False
+        for cim_class, sample in iter(inp.get, _stop):
+            if self.error or stale:
+                continue
+            try:
+                result = self.collector.accept(cim_class, sample)
+                if result is None:
+                    stale = True                # Not a new sample, the other classes are not looked at
+                    self.abort.set()
+                    continue
+                for table in result:
+                    out.put(table)
+            except Exception as err:
+                self._fail(err)
+        out.put(_stop)
+
+
+def open_connection(spec, cim_class):
+    """Connection of a ClassWorker: ('wbem', address, user, password, timeout) or ('replay', file, speed,
+    latency) serving the 'cim_class' queries only"""
+
+    import svcstats
+
+    if spec[0] == 'replay':
+        import svcreplay
+
+        request = svcstats.stats_query(cim_class, svcstats.headers[cim_class]['request'])
+        return svcreplay.Replay(spec[1], spec[2], only=(request,), latency=spec[3])
+
+    import pywbem
+
+    kind, target, user, password, timeout = spec
+    return pywbem.WBEMConnection('https://' + target, (user, password), 'root/ibm', no_verification=True,
+                                 timeout=timeout)
+
+
+def serve(spec, cim_class, pipe):
+    """ClassWorker process: answer every poll request with the Sample arrays or the error. A failed connection is
+    opened again on the next poll"""
+
+    import svcstats
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)                # The parent decides when to stop
+    connection = None
+    while pipe.recv():
+        try:
+            if connection is None:
+                connection = open_connection(spec, cim_class)
+            sample = svcstats.get_stats(connection, cim_class)
+            pipe.send(('sample', (sample.time, sample.ids, sample.counters) if sample else None))
+        except Exception as err:
+            if not isinstance(err, EOFError):
+                connection = None
+            try:
+                pickle.dumps(err)
+            except Exception:
+                err = RuntimeError(str(err))
+            pipe.send(('error', err))
+
+
+class ClassWorker:
+    """Worker process fetching and decoding the 'cim_class' with its own connection, see open_connection()"""
+
+    def __init__(self, spec, cim_class):
+        import multiprocessing
+
+        context = multiprocessing.get_context('spawn')          # Forking a process running threads is not safe
+        self.cim_class = cim_class
+        self.pending = False                                    # A poll was asked for and not read yet
+        self.stale = 0                                          # Results of the discarded polls still to come
+        self.pipe, child = context.Pipe()
+        self.process = context.Process(target=serve, args=(spec, cim_class, child), daemon=True)
+        self.process.start()
+        child.close()
+
+    def request(self):
+        """Ask for a poll, fetch() returns its result"""
+        if not self.pending:
+            self.pipe.send(True)
+            self.pending = True
+
+    def fetch(self):
+        """Return the Sample of the class or None if it has no instances"""
+
+        import svcstats
+
+        self.request()
+        self.pending = False
+        try:
+            while self.stale:
+                self.pipe.recv()                                # The replies come in the order of the requests
+                self.stale -= 1
+            status, value = self.pipe.recv()
+        except EOFError:
+            raise RuntimeError('The worker process of "{}" has exited'.format(self.cim_class))
+        if status == 'error':
+            raise value
+        if value is None:
+            return None
+        sample = svcstats.Sample(svcstats.headers[self.cim_class]['result'])
+        sample.time, sample.ids, sample.counters = value
+        return sample
+
+    def discard(self):
+        """Drop the result of a poll asked for and not fetched, so the next poll doesn't get it. The result is
+        skipped by the next fetch(), nothing waits for it here"""
+        if self.pending:
+            self.pending = False
+            self.stale += 1
+
+    def close(self):
+        try:
+            self.pipe.send(None)
+        except OSError:
+            pass                                                # Already gone
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def bench(filename, latency=0.02, depth=pipe_depth):
+    """Poll the replayed log with the serial Collector.poll() loop, the Pipeline and the Pipeline with worker
+    processes. Returns {mode: [seconds per interval, ...]}, the first interval without a delta is left out"""
+
+    import svcreplay
+    import svcstats
+
+    classes = [cim_class for cim_class in svcstats.metric_prefixes if svcreplay.replay_has(filename, cim_class)]
+    offloaded = [cim_class for cim_class in classes if cim_class in process_classes]
+
+    def sink(name, prefix, table, first):
+        svcstats.render_table(table, False, False, (('class', name),))
+
+    result = {}
+    for mode in ('serial', 'pipeline', 'processes'):
+        only = ()
+        if mode == 'processes':
+            only = [svcstats.stats_query(cim_class, svcstats.headers[cim_class]['request'])
+                    for cim_class in ['IBMTSSVC_Cluster'] + classes if cim_class not in offloaded]
+        replay = svcreplay.Replay(filename, 0, only=only, latency=latency)
+        collector = svcstats.Collector(cim_classes=classes, connection=replay)
+        collector.connect()
+        workers = {}
+        if mode == 'processes':
+            workers = {cim_class: ClassWorker(('replay', filename, 0, latency), cim_class) for cim_class in offloaded}
+        pipeline = Pipeline(collector, depth, workers)
+
+        spent = []
+        try:
+            while True:
+                t0 = time.perf_counter()
+                if mode == 'serial':
+                    for table in collector.poll():
+                        sink(*table)
+                else:
+                    pipeline.poll(sink)
+                spent.append(time.perf_counter() - t0)
+        except EOFError:
+            pass
+        pipeline.close()
+        replay.close()
+        result[mode] = spent[1:]
+    return result
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != 'bench':
+        print('Usage:\n\tsvcpipe.py bench file [latency_ms [depth]]', file=sys.stderr)
+        sys.exit(1)
+
+    latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.02
+    depth = int(sys.argv[4]) if len(sys.argv) > 4 else pipe_depth
+    result = bench(sys.argv[2], latency, depth)
+    if not result['serial']:
+        print('Error! The log has less than two intervals.', file=sys.stderr)
+        sys.exit(1)
+
+    print('{} intervals, {:.0f} ms latency per page, queue depth {}\n'.format(
+        len(result['serial']), latency * 1000, depth))
+    print('{0:12s}{1:>16s}{2:>16s}{3:>16s}'.format('mode', 'mean ms', 'max ms', 'speedup'))
+    serial = sum(result['serial']) / len(result['serial'])
+    for mode, spent in result.items():
+        mean = sum(spent) / len(spent) if spent else 0.0
+        print('{0:12s}{1:16.2f}{2:16.2f}{3:15.2f}x'.format(mode, mean * 1000, max(spent or [0]) * 1000,
+                                                             serial / mean if mean else 0))
+
+
+if __name__ == '__main__':
+    main()
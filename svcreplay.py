@@ -0,0 +1,811 @@
+#!/usr/bin/env python3
+#
+# Record and replay IBM SVC/Storwize statistics for offline runs and benchmarks
+#
+# A log is a gzip file of JSON lines, one record per CIM query or CLI command as the collectors saw them:
+#   {"time": epoch, "query": "SELECT ... FROM class", "fields": [...], "rows": [[...], ...]}
+#   {"time": epoch, "command": "lssystemstats -delim ,", "output": "..."}
+# Replay serves the records in place of a live WBEM connection or SSH session, paced by their recorded times
+# divided by 'speed', or as fast as possible with speed 0.
+#
+# Usage:
+#   svcreplay.py generate file [instances [intervals [class [frequency]]]]
+# Writes a synthetic log of 'instances' (default 1000) of the statistics class (default
+# IBMTSSVC_StorageVolumeStatistics) over 'intervals' (default 10) samples 'frequency' seconds (default 300) apart
+#   svcreplay.py bench file [table|csv|json|bin]
+# Replays the log as fast as possible through the svcstats.py pipeline and reports throughput and latency of
+# each stage
+#   svcreplay.py fleet file [targets [latency_ms]]
+# Polls 'targets' (default 50) replays of the log, each spending 'latency_ms' (default 200) per page of instances
+# to stand for a CIMOM, from 1 to 64 worker threads as svcstats.py -i does, and reports the polling round times
+#   svcreplay.py output [instances [file]]
+# Writes a synthetic vdisk delta table of 'instances' (default 10000) rows in every output format to a pipe and to
+# the file (default a temporary one) and reports the rows per second
+#   svcreplay.py delta [instances]
+# Times Sample construction and build_delta() on synthetic vdisk samples of 'instances' (default 10000) rows,
+# with the same instances and with one of them removed
+#   svcreplay.py decode [instances]
+# Times decoding a synthetic vdisk response of 'instances' (default 10000) pywbem CIMInstance objects, or their
+# stand-ins without pywbem, with the former per-row decode loop and with row_decoder()
+#   svcreplay.py memory [instances ...]
+# Traces the peak memory of collecting synthetic vdisk responses of every 'instances' count (default 2000, 8000
+# and 16000) streamed page by page into a Sample and held whole before decoding
+#   svcreplay.py sample [instances]
+# Traces the memory per 1000 rows of a synthetic vdisk sample of 'instances' (default 10000) rows kept as a list of
+# row lists with a time string each, as before Sample, and kept in a Sample
+#   svcreplay.py startup [runs]
+# Times the cold start of the svcstats.py and scstat_ssh.py usage, of importing svcstats and of an empty interpreter
+# in new processes, the best of 'runs' (default 15), and the cumulative svcstats import time of -X importtime
+#   svcreplay.py ssh [samples]
+# Times 'samples' (default 30) lssystemstats samples of scstat_ssh.py against a local paramiko server: with a new
+# session per sample, over one persistent session and streamed from the -l remote loop. Needs paramiko
+
+
+import gzip
+import json
+import random
+import sys
+import time
+from collections import deque
+
+
+class Value:
+    """CIM property stand-in: replayed code reads property values only"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Instance:
+    """CIM instance stand-in built of a recorded row"""
+
+    __slots__ = ('properties',)
+
+    def __init__(self, fields, row):
+        self.properties = dict(zip(fields, map(Value, row)))
+
+
+class Result:
+    """IterQueryInstances() result stand-in"""
+
+    __slots__ = ('generator',)
+
+    def __init__(self, generator):
+        self.generator = generator
+
+
+def plain(value):
+    """JSON friendly value: CIM integers lose their type, datetimes and other CIM types become strings"""
+
+    if value is None or isinstance(value, (bool, str, float)):
+        return value
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, list):
+        return [plain(val) for val in value]
+    return str(value)
+
+
+class Recorder:
+    """Append records to the log 'filename'. Every record is flushed, so the log stays readable if the collector is
+    killed"""
+
+    def __init__(self, filename):
+        self.file = gzip.open(filename, 'at', encoding='utf-8')
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.file.flush()
+
+    def query(self, request, fields, rows, timestamp=None):
+        self.write({'time': time.time() if timestamp is None else timestamp, 'query': request, 'fields': fields,
+                    'rows': rows})
+
+    def command(self, command, output, timestamp=None):
+        self.write({'time': time.time() if timestamp is None else timestamp, 'command': command, 'output': output})
+
+    def close(self):
+        self.file.close()
+
+
+class RecordingConnection:
+    """Pass queries to a live pywbem 'connection' and record the instances to the 'recorder'. Streamed results are
+    recorded row by row as they are consumed and written when the stream ends"""
+
+    def __init__(self, connection, recorder):
+        self.connection = connection
+        self.recorder = recorder
+
+    def ExecQuery(self, language, request, *args, **kwargs):
+        result = self.connection.ExecQuery(language, request, *args, **kwargs)
+        fields = list(result[0].properties) if result else []
+        self.recorder.query(request, fields, [[plain(inst.properties[fld].value) for fld in fields]
+                                              for inst in result])
+        return result
+
+    def IterQueryInstances(self, language, request, *args, **kwargs):
+        result = self.connection.IterQueryInstances(language, request, *args, **kwargs)
+        return Result(self._record(request, result.generator))
+
+    def _record(self, request, instances):
+        fields = None
+        rows = []
+        for inst in instances:
+            if fields is None:
+                fields = list(inst.properties)
+            rows.append([plain(inst.properties[fld].value) for fld in fields])
+            yield inst
+        self.recorder.query(request, fields or [], rows)
+
+
+class Replay:
+    """Serve recorded queries and commands from the log 'filename' in place of a live pywbem connection or SSH
+    session. A request gets the next recorded result of the same request, so the classes of a poll may be asked for
+    in any order. The recorded time distances are divided by 'speed', 0 replays as fast as possible.
+    With 'only' requests given, the records of the other ones are skipped instead of kept for later. 'latency'
+    seconds are spent on every page of pull operation results to stand for the network round trips.
+    EOFError is raised when the log has no more results for a request"""
+
+    def __init__(self, filename, speed=1.0, only=(), latency=0.0):
+        self.file = gzip.open(filename, 'rt', encoding='utf-8')
+        self.speed = speed
+        self.only = set(only)
+        self.latency = latency
+        self.pending = {}                                       # Records read ahead while looking for a request
+        self.start = None                                       # (monotonic clock, recorded time) of the 1st record
+        self.time = None                                        # Recorded time of the last result
+
+    def _next(self, key):
+        queue = self.pending.get(key)
+        if queue:
+            record = queue.popleft()
+        else:
+            while True:
+                try:
+                    ln = self.file.readline()
+                except EOFError:                                # The recorder was killed in the middle of a write
+                    ln = ''
+                if not ln:
+                    raise EOFError('End of the replay log for: "{}"'.format(key))
+                record = json.loads(ln)
+                rec_key = record.get('query', record.get('command'))
+                if rec_key == key:
+                    break
+                if self.only and rec_key not in self.only:
+                    continue
+                self.pending.setdefault(rec_key, deque()).append(record)
+
+        self.time = record['time']
+        if self.speed:
+            if self.start is None:
+                self.start = (time.monotonic(), record['time'])
+            time.sleep(max(0.0, self.start[0] + (record['time'] - self.start[1]) / self.speed - time.monotonic()))
+        return record
+
+    def ExecQuery(self, language, request, *args, **kwargs):
+        record = self._next(request)
+        return [Instance(record['fields'], row) for row in record['rows']]
+
+    def IterQueryInstances(self, language, request, *args, **kwargs):
+        record = self._next(request)
+        if self.latency:
+            return Result(self._paged(record, kwargs.get('MaxObjectCount') or len(record['rows']) or 1))
+        return Result(Instance(record['fields'], row) for row in record['rows'])
+
+    def _paged(self, record, page):
+        for n, row in enumerate(record['rows']):
+            if not n % page:
+                time.sleep(self.latency)
+            yield Instance(record['fields'], row)
+
+    def command(self, command):
+        """Return the recorded output of the CLI 'command'"""
+        return self._next(command)['output']
+
+    def close(self):
+        self.file.close()
+
+
+def generate(filename, instances=1000, intervals=10, cim_class='IBMTSSVC_StorageVolumeStatistics', frequency=300,
+             start=None):
+    """Write a synthetic log: the cluster record followed by 'intervals' samples of 'instances' rows of the
+    'cim_class' with growing counters, as svcstats.py queries them"""
+
+    import svcstats
+
+    recorder = Recorder(filename)
+    timestamp = start or time.time() - intervals * frequency
+    timestamp -= timestamp % frequency
+
+    fields = svcstats.headers['IBMTSSVC_Cluster']['request']
+    recorder.query(svcstats.stats_query('IBMTSSVC_Cluster', fields), fields, [[
+        '0000020060C00001', 'synthetic', '8.5.0.0', '192.0.2.1', ['', '', '', '', 'SVC'], 'OK', ['OK'],
+        frequency // 60, True
+    ]], timestamp)
+
+    fields = svcstats.headers[cim_class]['request']
+    counters = [fld for fld in fields if fld not in ('StatisticTime', 'InstanceID', 'ElementName')]
+    values = [[random.randrange(1 << 30) for fld in counters] for inst in range(instances)]
+    selector = svcstats.inst_selectors[cim_class]
+    request = svcstats.stats_query(cim_class, fields)
+
+    for interval in range(intervals):
+        timestamp += frequency
+        stat_time = time.strftime('%Y%m%d%H%M%S.000000+000', time.gmtime(timestamp))
+        rows = []
+        for inst, vals in enumerate(values):
+            for c in range(len(vals)):
+                vals[c] += random.randrange(1 << 16)
+            row = {'StatisticTime': stat_time, 'InstanceID': '{} {}'.format(selector, inst),
+                   'ElementName': 'Statistics of FC port {} for node {}'.format(inst % 4 + 1, inst // 4 + 1)}
+            row.update(zip(counters, vals))
+            rows.append([row[fld] for fld in fields])
+        recorder.query(request, fields, rows, timestamp)
+    recorder.close()
+
+
+def bench(filename, out_format='table'):
+    """Replay the log as fast as possible through the svcstats.py stages: fetch (log reading, stands for the CIMOM),
+    decode, sample (compact storage), delta, output (rollups, selection-free rendering). Returns
+    {stage: [seconds per interval, ...]} and the number of rows per interval"""
+
+    import svcstats
+
+    replay = Replay(filename, 0)
+    system = svcstats.get_system(replay)
+    frequency = system[1][7] * 60
+
+    classes = {}
+    with gzip.open(filename, 'rt', encoding='utf-8') as log:
+        for ln in log:
+            request = json.loads(ln).get('query', '')
+            cim_class = request.rsplit(' FROM ', 1)[-1].split()[0] if ' FROM ' in request else ''
+            if cim_class in svcstats.headers and cim_class != 'IBMTSSVC_Cluster':
+                classes.setdefault(cim_class, request)
+
+    stages = {'fetch': [], 'decode': [], 'sample': [], 'delta': [], 'output': []}
+    sizes = []
+    data = {cim_class: {'current': [], 'previous': [], 'delta': []} for cim_class in classes}
+    clock = time.perf_counter
+    while True:
+        elapsed = dict.fromkeys(stages, 0.0)
+        rows = 0
+        try:
+            for cim_class, request in classes.items():
+                t0 = clock()
+                instances = list(replay.IterQueryInstances(svcstats.query_language, request).generator)
+                t1 = clock()
+                decode = svcstats.row_decoder(cim_class, svcstats.headers[cim_class]['request'])
+                decoded = list(map(decode, instances))
+                t2 = clock()
+                data[cim_class]['current'] = svcstats.Sample(svcstats.headers[cim_class]['result'], decoded)
+                t3 = clock()
+                first = not data[cim_class]['previous']
+                delta = svcstats.build_delta(cim_class, data, frequency)
+                data[cim_class]['previous'] = data[cim_class]['current']
+                t4 = clock()
+                if not first:
+                    for name, prefix, table in svcstats.output_tables(cim_class, delta):
+                        if out_format == 'bin':
+                            svcstats.render_binary(table, (('class', name),))
+                        else:
+                            svcstats.writers[out_format](table, False, False, (('class', name),))
+                t5 = clock()
+                for stage, spent in zip(stages, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+                    elapsed[stage] += spent
+                rows += len(instances)
+        except EOFError:
+            break
+        if sizes:                                               # The first interval has no delta and no output
+            for stage in stages:
+                stages[stage].append(elapsed[stage])
+        sizes.append(rows)
+
+    replay.close()
+    return stages, sizes[1:]
+
+
+def bench_collector(filename, instruments=None, repeat=5):
+    """Best time in seconds of svcstats.Collector polling the whole log 'repeat' times, with or without
+    'instruments', to measure the instrumentation overhead"""
+
+    import svcstats
+
+    best = None
+    for run in range(repeat):
+        replay = Replay(filename, 0)
+        collector = svcstats.Collector(cim_classes=list(svcstats.metric_prefixes), connection=replay,
+                                       instruments=instruments)
+        collector.connect()
+        collector.cim_classes = [cim_class for cim_class in collector.cim_classes if replay_has(filename, cim_class)]
+        start = time.perf_counter()
+        try:
+            while True:
+                collector.poll()
+        except EOFError:
+            pass
+        spent = time.perf_counter() - start
+        best = spent if best is None else min(best, spent)
+        replay.close()
+    return best
+
+
+def bench_fleet(filename, targets=50, workers=8, latency=0.2):
+    """Wall times in seconds of the first polling round, connect included, and of the next one of 'targets'
+    svcstats.Collector replays of the log polled from a pool of 'workers' threads like in svcstats.py fleet mode"""
+
+    import svcstats
+    from concurrent import futures
+
+    classes = [cim_class for cim_class in svcstats.metric_prefixes if replay_has(filename, cim_class)]
+    collectors = [svcstats.Collector('target{}'.format(n), cim_classes=classes,
+                                     connection=Replay(filename, 0, latency=latency)) for n in range(targets)]
+    rounds = []
+    with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for run in range(2):
+            start = time.perf_counter()
+            list(pool.map(svcstats.poll_target, collectors))
+            rounds.append(time.perf_counter() - start)
+    for collector in collectors:
+        collector.connection.close()
+    return rounds
+
+
+def bench_delta(instances=10000, repeat=10):
+    """Best times in seconds of building a Sample of 'instances' vdisk rows and of build_delta() on two of them,
+    with the same instance set and with one instance removed in the middle"""
+
+    import svcstats
+
+    cim_class = 'IBMTSSVC_StorageVolumeStatistics'
+    header = svcstats.headers[cim_class]['result']
+    previous = [[svcstats.datetime('20260101000000'), inst] + [random.randrange(1 << 40) for c in header[2:]]
+                for inst in range(instances)]
+    current = [[svcstats.datetime('20260101000500'), inst] + [value + random.randrange(1 << 20) for value in row[2:]]
+               for inst, row in enumerate(previous)]
+    shifted = current[:instances // 2] + current[instances // 2 + 1:]
+
+    def best(func):
+        result = None
+        for run in range(repeat):
+            start = time.perf_counter()
+            func()
+            spent = time.perf_counter() - start
+            result = spent if result is None else min(result, spent)
+        return result
+
+    data = {cim_class: {'previous': svcstats.Sample(header, previous), 'current': None, 'delta': []}}
+    timings = {'sample': best(lambda: svcstats.Sample(header, current))}
+    for name, rows in (('same', current), ('removed', shifted)):
+        data[cim_class]['current'] = svcstats.Sample(header, rows)
+        timings[name] = best(lambda: svcstats.build_delta(cim_class, data, 300))
+    return timings
+
+
+def bench_output(instances=10000, filename='', repeat=5):
+    """Best rows per second of svcstats.print_stats() writing a delta table of 'instances' vdisk rows in every
+    output format to a pipe drained by a thread and to the 'filename'. Returns {format: (pipe, file)}"""
+
+    import os
+    import tempfile
+    import threading
+    import svcstats
+    from array import array
+
+    header = svcstats.headers['IBMTSSVC_StorageVolumeStatistics']['result']
+    table = svcstats.Sample.from_columns(header, svcstats.datetime('20260101000000'), array('q', range(instances)),
+                                         [[random.random() * 10000 for inst in range(instances)] for c in header[2:]])
+    temp = None
+    if not filename:
+        temp = tempfile.NamedTemporaryFile(suffix='.out', delete=False)
+        temp.close()
+        filename = temp.name
+
+    def best(out_format, to_pipe):
+        result = None
+        for run in range(repeat):
+            drain = None
+            if to_pipe:
+                rfd, wfd = os.pipe()
+                drain = threading.Thread(target=lambda: deque(iter(lambda: os.read(rfd, 1 << 16), b''), maxlen=0))
+                drain.start()
+                stream = os.fdopen(wfd, 'w')
+            else:
+                stream = open(filename, 'w')
+            svcstats.csv_headers.clear()
+            stdout, sys.stdout = sys.stdout, stream
+            try:
+                start = time.perf_counter()
+                svcstats.print_stats(table, False, True, out_format, (('class', 'vdisk'),))
+                spent = time.perf_counter() - start
+            finally:
+                sys.stdout = stdout
+                stream.close()
+                if drain:
+                    drain.join()
+                    os.close(rfd)
+            result = spent if result is None else min(result, spent)
+        return instances / result
+
+    try:
+        return {out_format: (best(out_format, True), best(out_format, False)) for out_format in svcstats.out_formats}
+    finally:
+        if temp:
+            os.remove(filename)
+
+
+def bench_decode(instances=10000, repeat=5):
+    """Best times in seconds of decoding 'instances' vdisk instances into rows with the per-row loop iter_stats()
+    ran before row_decoder(), and with row_decoder(). Returns (loop, decoder)"""
+
+    import svcstats
+
+    cim_class = 'IBMTSSVC_StorageVolumeStatistics'
+    fields = svcstats.headers[cim_class]['request']
+    selector = svcstats.inst_selectors[cim_class]
+    try:
+        import pywbem
+
+        def instance(inst):
+            return pywbem.CIMInstance(cim_class, properties=[
+                pywbem.CIMProperty('StatisticTime', pywbem.CIMDateTime('20261017120000.000000+000'))
+                if fld == 'StatisticTime' else pywbem.CIMProperty('InstanceID', '{} {}'.format(selector, inst))
+                if fld == 'InstanceID' else pywbem.CIMProperty(fld, pywbem.Uint64(random.randrange(1 << 40)))
+                for fld in fields])
+    except ImportError:
+        def instance(inst):
+            row = {'StatisticTime': '20261017120000.000000+000', 'InstanceID': '{} {}'.format(selector, inst)}
+            return Instance(fields, [row.get(fld) or random.randrange(1 << 40) for fld in fields])
+
+    stats = [instance(inst) for inst in range(instances)]
+
+    def loop():
+        # iter_stats() body before row_decoder()
+        for stat in stats:
+            ln = [
+                svcstats.datetime(str(stat.properties['StatisticTime'].value).split('.')[0]),    # 'StatisticTime'
+                int(stat.properties['InstanceID'].value.split()[1])                             # 'InstanceID'
+            ]
+            for fld in fields:
+                if fld != 'InstanceID' and fld != 'StatisticTime':
+                    if cim_class == 'IBMTSSVC_FCPortStatistics' and fld == 'ElementName':
+                        ports2nodes = stat.properties[fld].value.split()
+                        ln.insert(2, int(ports2nodes[7]))                                    # Node
+                        ln.insert(3, int(ports2nodes[4]))                                    # Port
+                    else:
+                        ln.append(int(stat.properties[fld].value))
+
+    def decoder():
+        decode = svcstats.row_decoder(cim_class, fields)
+        for stat in stats:
+            decode(stat)
+
+    def best(func):
+        result = None
+        for run in range(repeat):
+            start = time.perf_counter()
+            func()
+            spent = time.perf_counter() - start
+            result = spent if result is None else min(result, spent)
+        return result
+
+    return best(loop), best(decoder)
+
+
+class Synthetic:
+    """Connection stand-in generating 'instances' vdisks with random counters page by page as a CIMOM pulls them,
+    nothing is kept between the pages"""
+
+    def __init__(self, instances):
+        import svcstats
+
+        self.instances = instances
+        self.fields = svcstats.headers['IBMTSSVC_StorageVolumeStatistics']['request']
+        self.selector = svcstats.inst_selectors['IBMTSSVC_StorageVolumeStatistics']
+
+    def ExecQuery(self, language, request, *args, **kwargs):
+        import svcstats
+
+        return [Instance(svcstats.headers['IBMTSSVC_Cluster']['request'], [
+            '0000020060C00001', 'synthetic', '8.5.0.0', '192.0.2.1', ['', '', '', '', 'SVC'], 'OK', ['OK'], 5, True])]
+
+    def IterQueryInstances(self, language, request, *args, **kwargs):
+        return Result(self._pages(kwargs.get('MaxObjectCount') or self.instances))
+
+    def _pages(self, page):
+        for first in range(0, self.instances, page):
+            rows = []
+            for inst in range(first, min(first + page, self.instances)):
+                row = {'StatisticTime': '20261017120000.000000+000', 'InstanceID': '{} {}'.format(self.selector, inst)}
+                rows.append(Instance(self.fields, [row.get(fld) or random.randrange(1 << 40) for fld in self.fields]))
+            yield from rows
+
+
+def bench_memory(instances):
+    """Peak traced memory in bytes of collecting a Synthetic response of 'instances' vdisks with get_stats(),
+    streamed page by page into a Sample, and with the whole response held before decoding, and the size of the
+    Sample. Returns (streamed, whole, sample)"""
+
+    import tracemalloc
+    import svcstats
+
+    cim_class = 'IBMTSSVC_StorageVolumeStatistics'
+    request = svcstats.stats_query(cim_class, svcstats.headers[cim_class]['request'])
+    decode = svcstats.row_decoder(cim_class, svcstats.headers[cim_class]['request'])
+
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        sample = svcstats.get_stats(Synthetic(instances), cim_class)
+        held, streamed = tracemalloc.get_traced_memory()
+        del sample
+
+        tracemalloc.reset_peak()
+        response = list(Synthetic(instances).IterQueryInstances(svcstats.query_language, request).generator)
+        sample = svcstats.Sample(svcstats.headers[cim_class]['result'], map(decode, response))
+        whole = tracemalloc.get_traced_memory()[1]
+        del response, sample
+    finally:
+        tracemalloc.stop()
+    return streamed - start, whole - start, held - start
+
+
+def bench_sample(instances=10000):
+    """Traced bytes per 1000 rows of a sample of 'instances' vdisk rows as a list of decoded row lists, the header
+    first, and as a Sample. Returns (rows, sample)"""
+
+    import tracemalloc
+    import svcstats
+
+    cim_class = 'IBMTSSVC_StorageVolumeStatistics'
+    header = svcstats.headers[cim_class]['result']
+
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        rows = [header] + [[svcstats.datetime('20261017120000'), inst] + [random.randrange(1 << 40) for c in header[2:]]
+                           for inst in range(instances)]
+        listed = tracemalloc.get_traced_memory()[0] - start
+
+        sample = svcstats.Sample(header, rows[1:])
+        del rows
+        sampled = tracemalloc.get_traced_memory()[0] - start
+        del sample
+    finally:
+        tracemalloc.stop()
+    return listed * 1000 / instances, sampled * 1000 / instances
+
+
+def bench_startup(runs=15):
+    """Best wall times in seconds of the commands of a new interpreter started 'runs' times each, and the import
+    time of svcstats in seconds as -X importtime reports it. Returns ({name: time}, import time)"""
+
+    import os
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    commands = {
+        'svcstats.py usage': [sys.executable, 'svcstats.py'],
+        'scstat_ssh.py usage': [sys.executable, 'scstat_ssh.py'],
+        'import svcstats': [sys.executable, '-c', 'import svcstats'],
+        'python -c pass': [sys.executable, '-c', 'pass'],
+    }
+
+    timings = {}
+    for name, command in commands.items():
+        for run in range(runs):
+            start = time.perf_counter()
+            subprocess.run(command, cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            spent = time.perf_counter() - start
+            timings[name] = min(timings.get(name, spent), spent)
+
+    # "import time: self [us] | cumulative | imported package" lines on stderr, the module itself is the last one
+    report = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import svcstats'], cwd=here,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True).stderr
+    imported = [ln.split('|') for ln in report.splitlines() if ln.rstrip().endswith('| svcstats')]
+    return timings, int(imported[-1][1]) / 1e6 if imported else None
+
+
+def bench_ssh(samples=30, metrics=40, period=0.1):
+    """Per sample latencies in seconds of scstat_ssh.py against a local paramiko server answering lssystemstats
+    with 'metrics' lines: {'session': new session per sample, 'persistent': ssh_exec() over one session, 'stream':
+    from the remote loop writing a sample every 'period' seconds to ssh_stream() reading its end}"""
+
+    import socket
+    import threading
+    import paramiko
+    import scstat_ssh
+
+    output = 'stat_name,stat_current,stat_peak,stat_peak_time\n' + \
+        ''.join('stat{0},{0},{0},261017120000\n'.format(m) for m in range(metrics))
+    sent = []                                                   # Times the remote loop wrote its samples
+
+    class Server(paramiko.ServerInterface):
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+        def check_channel_exec_request(self, channel, command):
+            threading.Thread(target=self.run, args=(channel, command), daemon=True).start()
+            return True
+
+        @staticmethod
+        def run(channel, command):
+            try:
+                while command.startswith(b'while true'):
+                    sent.append(time.perf_counter())
+                    channel.sendall(output.encode() + b'\n')
+                    time.sleep(period)
+                channel.sendall(output.encode())
+                channel.send_exit_status(0)
+                channel.shutdown_write()                        # The client closes, the request may not be acked yet
+            except (OSError, EOFError):
+                pass                                            # The client has gone
+
+    key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+    port = listener.getsockname()[1]
+
+    def accept():
+        while True:
+            try:
+                conn, address = listener.accept()
+            except OSError:
+                return                                          # Closed, the benchmark is over
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(key)
+            transport.start_server(server=Server())
+
+    threading.Thread(target=accept, daemon=True).start()
+    command = 'lssystemstats -delim ,'
+    result = {'session': [], 'persistent': [], 'stream': []}
+
+    for n in range(samples):
+        start = time.perf_counter()
+        client = scstat_ssh.ssh_connect('127.0.0.1', 'user', 'password', port)
+        scstat_ssh.ssh_exec(command, client)
+        client.close()
+        result['session'].append(time.perf_counter() - start)
+
+    client = scstat_ssh.ssh_connect('127.0.0.1', 'user', 'password', port)
+    for n in range(samples):
+        start = time.perf_counter()
+        scstat_ssh.ssh_exec(command, client)
+        result['persistent'].append(time.perf_counter() - start)
+
+    stream = scstat_ssh.ssh_stream('while true; do {}; echo; sleep 1; done'.format(command), client, 10)
+    for ln in stream:
+        if not ln:                                              # The end of a sample
+            result['stream'].append(time.perf_counter() - sent[len(result['stream'])])
+            if len(result['stream']) == samples:
+                break
+    client.close()
+    listener.close()
+    return result
+
+
+def replay_has(filename, cim_class):
+    """Tell if the log has records of the 'cim_class' queries"""
+    with gzip.open(filename, 'rt', encoding='utf-8') as log:
+        return any(' FROM ' + cim_class in json.loads(ln).get('query', '') for ln in log)
+
+
+def main():
+    with_file = ('generate', 'bench', 'fleet')
+    without_file = ('output', 'delta', 'decode', 'memory', 'sample', 'startup', 'ssh')
+    if len(sys.argv) < 2 or sys.argv[1] not in with_file + without_file or \
+            len(sys.argv) < 3 and sys.argv[1] in with_file:
+        print('Usage:\n\tsvcreplay.py generate file [instances [intervals [class [frequency]]]]\n'
+              '\tsvcreplay.py bench file [table|csv|json|bin]\n'
+              '\tsvcreplay.py fleet file [targets [latency_ms]]\n'
+              '\tsvcreplay.py output [instances [file]]\n'
+              '\tsvcreplay.py delta [instances]\n'
+              '\tsvcreplay.py decode [instances]\n'
+              '\tsvcreplay.py memory [instances ...]\n'
+              '\tsvcreplay.py sample [instances]\n'
+              '\tsvcreplay.py startup [runs]\n'
+              '\tsvcreplay.py ssh [samples]', file=sys.stderr)
+        sys.exit(1)
+
+    if sys.argv[1] == 'decode':
+        loop, decoder = bench_decode(int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
+        print('{0:>10s}{1:12.1f} ms'.format('loop', loop * 1000))
+        print('{0:>10s}{1:12.1f} ms, {2:.1f}x faster'.format('decoder', decoder * 1000, loop / decoder))
+        sys.exit(0)
+
+    if sys.argv[1] == 'memory':
+        print('{0:>10s}{1:>16s}{2:>16s}{3:>16s}'.format('instances', 'streamed MB', 'whole MB', 'Sample MB'))
+        for instances in [int(arg) for arg in sys.argv[2:]] or [2000, 8000, 16000]:
+            sizes = [size / 1e6 for size in bench_memory(instances)]
+            print('{0:10d}{1:16.1f}{2:16.1f}{3:16.1f}'.format(instances, *sizes))
+        sys.exit(0)
+
+    if sys.argv[1] == 'sample':
+        listed, sampled = bench_sample(int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
+        print('{0:>10s}{1:16.0f} bytes per 1000 rows'.format('rows', listed))
+        print('{0:>10s}{1:16.0f} bytes per 1000 rows, {2:.1f}x smaller'.format('Sample', sampled, listed / sampled))
+        sys.exit(0)
+
+    if sys.argv[1] == 'startup':
+        timings, imported = bench_startup(int(sys.argv[2]) if len(sys.argv) > 2 else 15)
+        for name, spent in timings.items():
+            print('{0:>20s}{1:10.1f} ms'.format(name, spent * 1000))
+        if imported is not None:
+            print('{0:>20s}{1:10.1f} ms'.format('svcstats importtime', imported * 1000))
+        sys.exit(0)
+
+    if sys.argv[1] == 'ssh':
+        latencies = bench_ssh(int(sys.argv[2]) if len(sys.argv) > 2 else 30)
+        print('{} lssystemstats samples\n'.format(len(latencies['session'])))
+        print('{0:12s}{1:>12s}{2:>12s}{3:>12s}'.format('mode', 'median ms', 'min ms', 'max ms'))
+        for mode, spent in latencies.items():
+            spent.sort()
+            print('{0:12s}{1:12.2f}{2:12.2f}{3:12.2f}'.format(
+                mode, spent[len(spent) // 2] * 1000, spent[0] * 1000, spent[-1] * 1000))
+        sys.exit(0)
+
+    if sys.argv[1] == 'fleet':
+        targets = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+        latency = int(sys.argv[4]) / 1000 if len(sys.argv) > 4 else 0.2
+        print('{} targets, {:.0f} ms per page\n'.format(targets, latency * 1000))
+        print('{0:10s}{1:>16s}{2:>16s}'.format('workers', 'first round s', 'next round s'))
+        for workers in (1, 8, 32, 64):
+            if workers <= targets:
+                rounds = bench_fleet(sys.argv[2], targets, workers, latency)
+                print('{0:<10d}{1:16.2f}{2:16.2f}'.format(workers, *rounds))
+        sys.exit(0)
+
+    if sys.argv[1] == 'output':
+        instances = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+        rates = bench_output(instances, *sys.argv[3:4])
+        print('{} vdisk rows\n'.format(instances))
+        print('{0:10s}{1:>16s}{2:>16s}'.format('format', 'pipe rows/s', 'file rows/s'))
+        for out_format, (pipe, file) in rates.items():
+            print('{0:10s}{1:16.0f}{2:16.0f}'.format(out_format, pipe, file))
+        sys.exit(0)
+
+    if sys.argv[1] == 'delta':
+        instances = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+        timings = bench_delta(instances)
+        print('{} vdisks'.format(instances))
+        print('Sample() construction      {:8.2f} ms'.format(timings['sample'] * 1000))
+        print('build_delta(), same ids    {:8.2f} ms'.format(timings['same'] * 1000))
+        print('build_delta(), one removed {:8.2f} ms'.format(timings['removed'] * 1000))
+        sys.exit(0)
+
+    if sys.argv[1] == 'generate':
+        args = sys.argv[3:]
+        generate(sys.argv[2], *[int(arg) if n != 2 else arg for n, arg in enumerate(args)])
+        sys.exit(0)
+
+    timings, sizes = bench(sys.argv[2], *sys.argv[3:4])
+    if not sizes:
+        print('Error! The log has less than two intervals.', file=sys.stderr)
+        sys.exit(1)
+    total_rows = sum(sizes)
+    print('{} intervals, {} rows\n'.format(len(sizes), total_rows))
+    print('{0:10s}{1:>16s}{2:>16s}{3:>16s}'.format('stage', 'rows/s', 'mean ms', 'max ms'))
+    for stage, spent in list(timings.items()) + [('total', [sum(t) for t in zip(*timings.values())])]:
+        print('{0:10s}{1:16.0f}{2:16.2f}{3:16.2f}'.format(
+            stage, total_rows / sum(spent) if sum(spent) else 0, sum(spent) / len(spent) * 1000, max(spent) * 1000))
+
+    import svcinstr
+
+    bare = bench_collector(sys.argv[2])
+    instrumented = bench_collector(sys.argv[2], svcinstr.Instruments())
+    print('\nCollector.poll() {:.2f} ms per interval, {:.2f} ms instrumented ({:+.1f}%)'.format(
+        bare / (len(sizes) + 1) * 1000, instrumented / (len(sizes) + 1) * 1000, (instrumented / bare - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
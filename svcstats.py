@@ -19,17 +19,26 @@
 # Used CIM Classes:
 # System info - IBMTSSVC_Cluster
 # Performance statistics - IBMTSSVC_NodeStatistics, IBMTSSVC_StorageVolumeStatistics,
-# IBMTSSVC_BackendVolumeStatistics and IBMTSSVC_DiskDriveStatistics
+# IBMTSSVC_BackendVolumeStatistics, IBMTSSVC_DiskDriveStatistics and IBMTSSVC_FCPortStatistics
 
 
-import pywbem
 import time
+import calendar
 import sys
+import os
 import getopt
+import heapq
+import json
+import struct
+import operator
+import threading
+from array import array
 
 
 query_language = 'DMTF:CQL'                     # CIM Query Language
 # query_language = 'WQL'                        # WBEM Query Language
+page_size = 1000                                # Instances to receive per pull operation
+filter_batch = 100                              # InstanceIDs per request when selected instances are queried
 
 headers = {
     # Field names to request and headers to show
@@ -60,6 +69,18 @@ headers = {
         ],
         'result': ['Time', 'ID', 'rKB/s', 'wKB/s', 'tKB/s', 'rIO/s', 'wIO/s', 'tIO/s']
     },
+    'IBMTSSVC_FCPortStatistics': {
+        # 'ElementName' is decoded into 'Node' and 'Port' columns which are kept as is in the delta
+        'request': [
+            'StatisticTime', 'InstanceID', 'ElementName', 'BytesTransmitted', 'BytesReceived', 'PacketsTransmitted',
+            'PacketsReceived', 'LinkFailures', 'LossOfSignalCounter', 'LossOfSyncCounter', 'CRCErrors',
+            'InvalidTransmissionWords'
+        ],
+        'result': [
+            'Time', 'ID', 'Node', 'Port', 'txB/s', 'rxB/s', 'txP/s', 'rxP/s', 'LinkFail/s', 'LossSig/s', 'LossSync/s',
+            'CRC/s', 'InvTxW/s'
+        ]
+    },
     'IBMTSSVC_NodeStatistics': {
         'request': ['StatisticTime', 'InstanceID', 'ReadIOs', 'WriteIOs', 'TotalIOs', 'ReadHitIOs', 'WriteHitIOs'],
         'result': ['Time', 'ID', 'rIO/s', 'wIO/s', 'tIO/s', 'rHitIO/s', 'wHitIO/s']
@@ -76,43 +97,83 @@ headers = {
     }
 }
 
-data = {
-    # A structure for holding results data
-    'IBMTSSVC_Cluster': {
-        'current': [],
-        'previous': [],
-    },
-    'IBMTSSVC_BackendVolumeStatistics': {
-        'current': [],
-        'previous': [],
-        'delta': []
-    },
-    'IBMTSSVC_DiskDriveStatistics': {
-        'current': [],
-        'previous': [],
-        'delta': []
-    },
-    'IBMTSSVC_NodeStatistics': {
-        'current': [],
-        'previous': [],
-        'delta': []
-    },
-    'IBMTSSVC_StorageVolumeStatistics': {
-        'current': [],
-        'previous': [],
-        'delta': []
-    }
+# Response time columns and IO rate columns they are divided by
+response_times = {'ms/rIO': 'rIO/s', 'ms/wIO': 'wIO/s', 'ms/tIO': 'tIO/s'}
+
+# Columns which are not counters: they identify the instance and are copied into the delta as they are
+key_columns = ('Node', 'Port')
+
+# Classes to aggregate per value of a key column, and for the whole cluster, next to the per instance table
+rollups = {'IBMTSSVC_FCPortStatistics': 'Node'}
+
+# Vdisk groupings selected with -g and headers of their group columns. Vdisk to group mappings are fetched over SSH
+grouped_class = 'IBMTSSVC_StorageVolumeStatistics'
+groupings = {'iogrp': 'IOgrp', 'pool': 'Pool', 'host': 'Host'}
+groups_refresh = 3600                               # Seconds to keep the fetched mappings before fetching them again
+
+# Output formats: text renderers, 'bin' is written as bytes by print_stats()
+out_formats = ('table', 'csv', 'json', 'bin')
+delimiter_csv = ','
+csv_headers = set()                                 # Titles of the tables whose CSV header is already written
+
+# InstanceID prefixes of the statistics classes, e.g. 'StorageVolumeStats 12'
+inst_selectors = {
+    'IBMTSSVC_BackendVolumeStatistics': 'BackendVolumeStats', 'IBMTSSVC_DiskDriveStatistics': 'DiskDriveStats',
+    'IBMTSSVC_FCPortStatistics': 'FCPortStatistics', 'IBMTSSVC_NodeStatistics': 'NodeStats',
+    'IBMTSSVC_StorageVolumeStatistics': 'StorageVolumeStats'
+}
+
+# Row decoders built by row_decoder(), one per class and field list in every thread: their memos are not shared
+decoders = threading.local()
+
+# Command line switches to select statistics classes
+class_opts = {
+    '-n': 'IBMTSSVC_NodeStatistics',
+    '-v': 'IBMTSSVC_StorageVolumeStatistics',
+    '-m': 'IBMTSSVC_BackendVolumeStatistics',
+    '-d': 'IBMTSSVC_DiskDriveStatistics',
+    '-F': 'IBMTSSVC_FCPortStatistics'
+}
+
+# Scheduler settings
+sched_guard = 2                                     # Seconds to wait after the moment a new sample is expected
+sched_retry = 1                                     # First retry delay, seconds, if the sample is not there yet
+
+# Exported metric name prefixes
+metric_prefixes = {
+    'IBMTSSVC_NodeStatistics': 'svc_node',
+    'IBMTSSVC_StorageVolumeStatistics': 'svc_vdisk',
+    'IBMTSSVC_BackendVolumeStatistics': 'svc_mdisk',
+    'IBMTSSVC_DiskDriveStatistics': 'svc_drive',
+    'IBMTSSVC_FCPortStatistics': 'svc_fcport'
 }
 
 # Warning/error messages
 nop_error = 'Error! You must specify all mandatory options to get data.'
 frequency_warn = 'Warning! Sample frequency is invalid. Using frequency value from the storage system: {}.'
+missed_warn = 'Warning! {}Missed {} statistics interval(s).'
+nodata_warn = 'Warning! {}There is no data to collect for: "{}".'
+inventory_error = 'Error! Unable to read inventory file: "{}".'
+fleet_warn = 'Warning! {}: {}'
+groups_warn = 'Warning! {}: Unable to fetch vdisk mappings: {}'
+reconnect_warn = 'Warning! {}: {}. Reconnecting in {:.0f} seconds.'
+store_warn = 'Warning! {}Unable to store the "{}" table: {}'
+checkpoint_warn = 'Warning! {}Unable to write the checkpoint "{}": {}'
+
+# Fleet mode defaults
+fleet_workers = 8                                   # Maximum number of targets polled at the same time
+fleet_timeout = 60                                  # CIMOM request timeout per target, seconds
+fleet_backoff = 30                                  # First retry delay of a failed target, doubled on each failure
+
+# Checkpoints of the last raw samples
+checkpoint_age = 86400                              # Seconds, samples with an older StatisticTime are not restored
+checkpoint_suffix = '.ckpt'                         # Checkpoint file name suffix of a fleet target
 
 
 # CIM Classes description
 #  System info: IBMTSSVC_Cluster
 # Performance statistics: IBMTSSVC_NodeStatistics, IBMTSSVC_StorageVolumeStatistics,
-# IBMTSSVC_BackendVolumeStatistics and IBMTSSVC_DiskDriveStatistics
+# IBMTSSVC_BackendVolumeStatistics, IBMTSSVC_DiskDriveStatistics and IBMTSSVC_FCPortStatistics
 
 
 def usage(err_code=1, err_text=''):
@@ -122,19 +183,77 @@ def usage(err_code=1, err_text=''):
     print('Report IBM SVC/Storwize storage system performance statistics\n'
           '\n'
           'Usage:\n'
-          '\tsvcstats.py -n|-v|-m|-d -a address -u user -p password [-f minutes] [-ht]\n'
+          '\tsvcstats.py [-n][-v][-m][-d][-F] -a address -u user -p password [-f minutes] [-ht]\n'
+          '\t\t[-g groupings] [-s column [-N count] [-T threshold]] [-o format] [-e port] [-W file]\n'
+          '\t\t[-I seconds] [-J file] [-D] [-K file] [-A file] [-S directory] [-q depth] [-Q]\n'
+          '\tsvcstats.py [-n][-v][-m][-d][-F] -P file [-x speed] [-ht] [-s column [-N count] [-T threshold]]\n'
+          '\t\t[-o format] [-e port] [-I seconds] [-J file] [-A file] [-S directory] [-q depth] [-Q]\n'
+          '\tsvcstats.py [-n][-v][-m][-d][-F] -i inventory [-c workers] [-w seconds] [-f minutes] [-ht]\n'
+          '\t\t[-g groupings] [-s column [-N count] [-T threshold]] [-o format] [-e port] [-I seconds] [-J file]\n'
+          '\t\t[-D] [-K directory] [-A file] [-S directory]\n'
           '\n'
           'Options:\n'
-          '\t-n, -v, -m or -d\n'
-          'Show nodes, vdisks, mdisks or drives performance statistics\n'
+          '\t-n, -v, -m, -d and/or -F\n'
+          'Show nodes, vdisks, mdisks, drives and/or FC ports performance statistics. Any combination of the options\n'
+          'may be specified, all the selected classes are collected over a single connection. FC ports are also\n'
+          'summarized per node and for the whole cluster\n'
           '\t-a address -u user -p password\n'
           'Valid IP/DNS address, username and passwors to connect with IBM SVC/Storwize storage system\n'
+          '\t-i inventory [-c workers] [-w seconds]\n'
+          'Fleet mode: poll all the storage systems listed in the inventory file concurrently instead of -a/-u/-p.\n'
+          'Each line is "address user password [nvmdF]", the last field overrides the -n/-v/-m/-d/-F options.\n'
+          'At most "workers" (default 8) systems are queried at the same time, each request times out in "seconds"\n'
+          '(default 60). Failed systems are retried with exponential backoff without delaying the others\n'
+          '\t[-g iogrp,pool,host]\n'
+          'Also show vdisk statistics summarized per I/O group, storage pool and/or host, response times are weighted\n'
+          'by the number of IOs. Vdisk mappings are read with lsvdisk and lshostvdiskmap over SSH using the same\n'
+          'user and password, and refreshed every hour\n'
+          '\t[-s column] [-N count] [-T threshold]\n'
+          'Show only the "count" instances with the highest "column" values, e.g. "-s ms/tIO -N 20", and/or only the\n'
+          'instances whose "column" value is not less than "threshold". Column names are the ones of the table header\n'
+          '\t[-o table|csv|json|bin]\n'
+          'Output format: fixed width table (default), CSV, JSON Lines or binary columnar records\n'
+          '\t[-e port]\n'
+          'Exporter mode: serve the latest statistics in Prometheus text format on http://host:port/metrics\n'
+          'instead of printing them\n'
+          '\t[-W file]\n'
+          'Record the CIM query results into the gzip log file while collecting. See svcreplay.py\n'
+          '\t-P file [-x speed]\n'
+          'Replay the recorded log instead of connecting to the storage system. The recorded intervals are\n'
+          'shortened "speed" times (default 1), 0 replays them as fast as possible\n'
+          '\t[-I seconds] [-J file]\n'
+          'Time every stage of the collection (CIMOM operations, fetch, decode, delta, output...) into latency\n'
+          'histograms and count instances, requests, received bytes and retries. Every "seconds" (default 60 with -J)\n'
+          'print a summary line of the counters and p50/p90/p99/max milliseconds per stage to stderr and/or append\n'
+          'a JSON snapshot to the file. See svcinstr.py\n'
+          '\t[-D]\n'
+          'Daemon mode: keep a standby session to every storage system and health check it before each poll, switch\n'
+          'to it at once if a query fails and reconnect with exponential backoff if no session works. The last\n'
+          'samples are kept, so the first delta after an outage is valid. SIGHUP reopens the sessions, detects the\n'
+          'statistics interval, refetches vdisk mappings, rereads the inventory and reopens the -J file. SIGTERM and\n'
+          'SIGINT finish the sample in flight and exit\n'
+          '\t[-K file|directory]\n'
+          'Checkpoint the last raw counters of every class into the file, or into a file per storage system in the\n'
+          'directory in fleet mode. A restarted collector restores the counters of the same cluster not older than\n'
+          '24 hours, so its first poll already reports a delta\n'
+          '\t[-A file]\n'
+          'Alert on ms/rIO, ms/wIO and tIO/s values of every instance that stray from their moving average by more\n'
+          'than 4 standard deviations. Alerts are printed to stderr and appended to the file as JSON lines in the\n'
+          'interval they are detected. See svcalert.py\n'
+          '\t[-S directory]\n'
+          'Store every delta table into columnar segment files per table and day in the directory, to be queried\n'
+          'by time range, address, InstanceIDs and column conditions. See svcstore.py\n'
+          '\t[-q depth] [-Q]\n'
+          'Run the fetch, decode, delta and output stages of a poll in threads connected by queues of "depth" pages\n'
+          'of instances (default 4), so the CIMOM round trips overlap the processing. With -Q vdisks, mdisks and\n'
+          'drives are fetched and decoded in a worker process per class with its own connection. Not supported in\n'
+          'fleet mode, -Q is not supported with -W. See svcpipe.py\n'
           '\t[-f minutes]\n'
           'Optional report frequency interval. Must not be less then default "StatisticsFrequency" value\n'
           '\t[-h]\n'
           'Disable column headers\n'
           '\t[-t]\n'
-          'Show report date/time creation timestamp on the storage system\n'
+          'Show report date/time creation timestamp on the storage system in the local time of the collector\n'
           )
     sys.exit(err_code)
 
@@ -149,7 +268,7 @@ def exit_prog(err_code=1, err_text=''):
 def get_cmdopts():
     opts = ''
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'nvmda:u:p:f:ht')
+        opts, args = getopt.getopt(sys.argv[1:], 'nvmdFa:u:p:f:hti:c:w:e:o:s:N:T:g:W:P:x:I:J:DK:A:S:q:Q')
     except getopt.GetoptError as err:
         usage(1, str(err))
 
@@ -157,23 +276,38 @@ def get_cmdopts():
         usage(1, nop_error)
 
     # Defaults
-    cim_class = ''
+    cim_classes = []
     target = ''
     user = ''
     password = ''
     frequency = 0                                            # Fetch RefreshInterval from the storage system
     skip_header = False
     skip_time = True
+    inventory = ''
+    port = 0
+    out_format = 'table'
+    top_column = ''
+    top_count = 0
+    threshold = None
+    kinds = []
+    record = ''
+    replay = ''
+    speed = 1.0
+    report = 0
+    report_file = ''
+    daemon = False
+    checkpoint = ''
+    alerts = ''
+    store = ''
+    depth = 0
+    processes = False
+    workers = fleet_workers
+    timeout = fleet_timeout
 
     for opt, arg in opts:
-        if opt == '-n':
-            cim_class = 'IBMTSSVC_NodeStatistics'
-        elif opt == '-v':
-            cim_class = 'IBMTSSVC_StorageVolumeStatistics'
-        elif opt == '-m':
-            cim_class = 'IBMTSSVC_BackendVolumeStatistics'
-        elif opt == '-d':
-            cim_class = 'IBMTSSVC_DiskDriveStatistics'
+        if opt in class_opts:
+            if class_opts[opt] not in cim_classes:
+                cim_classes.append(class_opts[opt])
         elif opt == '-a':
             target = arg
         elif opt == '-u':
@@ -189,15 +323,100 @@ def get_cmdopts():
             skip_header = True
         elif opt == '-t':
             skip_time = False
+        elif opt == '-i':
+            inventory = arg
+        elif opt == '-o':
+            if arg not in out_formats:
+                usage(1, 'Error! Wrong output format specified.')
+            out_format = arg
+        elif opt == '-s':
+            top_column = arg
+        elif opt == '-W':
+            record = arg
+        elif opt == '-J':
+            report_file = arg
+        elif opt == '-D':
+            daemon = True
+        elif opt == '-K':
+            checkpoint = arg
+        elif opt == '-A':
+            alerts = arg
+        elif opt == '-S':
+            store = arg
+        elif opt == '-Q':
+            processes = True
+        elif opt == '-P':
+            replay = arg
+        elif opt == '-x':
+            try:
+                speed = float(arg)
+                if speed < 0:
+                    raise ValueError
+            except ValueError:
+                usage(1, 'Error! Wrong "{} {}" value.'.format(opt, arg))
+        elif opt == '-g':
+            for kind in arg.split(','):
+                if kind not in groupings:
+                    usage(1, 'Error! Wrong grouping "{}" specified.'.format(kind))
+                if kind not in kinds:
+                    kinds.append(kind)
+        elif opt == '-T':
+            try:
+                threshold = float(arg)
+            except ValueError:
+                usage(1, 'Error! Wrong "{} {}" value.'.format(opt, arg))
+        elif opt in ('-c', '-w', '-e', '-N', '-I', '-q'):
+            try:
+                if int(arg) < 1:
+                    raise ValueError
+            except ValueError:
+                usage(1, 'Error! Wrong "{} {}" value.'.format(opt, arg))
+            if opt == '-c':
+                workers = int(arg)
+            elif opt == '-w':
+                timeout = int(arg)
+            elif opt == '-N':
+                top_count = int(arg)
+            elif opt == '-I':
+                report = int(arg)
+            elif opt == '-q':
+                depth = int(arg)
+            else:
+                port = int(arg)
         else:
             pass                                            # Unknown options are detected by getopt() exception above
 
-    if not cim_class or not target or not user or not password:
+    if (top_count or threshold is not None) and not top_column:
+        usage(1, 'Error! Specify the column to select instances by with "-s column".')
+
+    if inventory:
+        if checkpoint and not os.path.isdir(checkpoint):
+            usage(1, 'Error! Checkpoint directory "{}" does not exist.'.format(checkpoint))
+        if record or replay:
+            usage(1, 'Error! Recording and replay are supported for a single storage system only.')
+        if depth or processes:
+            usage(1, 'Error! The pipeline is supported for a single storage system only.')
+        if not cim_classes:
+            cim_classes = list(class_opts.values())[:1]     # Nodes, unless inventory lines say otherwise
+    elif not cim_classes or not replay and (not target or not user or not password):
         usage(1, nop_error)
+    elif processes and record:
+        usage(1, 'Error! Worker processes use own connections which can\'t be recorded.')
+
+    if top_column:
+        # The column has to be one of a selected class, the tables of the other classes are shown in full
+        classes = class_opts.values() if inventory else cim_classes    # Inventory lines may select any class
+        if not any(top_column in headers[cim_class]['result'][2:] for cim_class in classes):
+            usage(1, 'Error! Unknown column "{}" to select instances by.'.format(top_column))
 
     return {
-        'cim_class': cim_class, 'target': target, 'user': user, 'password': password, 'frequency': frequency,
-        'skip_header': skip_header, 'skip_time': skip_time
+        'cim_classes': cim_classes, 'target': target, 'user': user, 'password': password, 'frequency': frequency,
+        'skip_header': skip_header, 'skip_time': skip_time, 'inventory': inventory, 'workers': workers,
+        'timeout': timeout, 'port': port, 'out_format': out_format,
+        'selection': (top_column, top_count, threshold) if top_column else (), 'groupings': kinds,
+        'record': record, 'replay': replay, 'speed': speed, 'report': report, 'report_file': report_file,
+        'daemon': daemon, 'checkpoint': checkpoint, 'alerts': alerts, 'store': store, 'depth': depth,
+        'processes': processes
     }
 
 
@@ -209,7 +428,7 @@ def get_system(wbem_connection):
     fields = headers['IBMTSSVC_Cluster']['request']
 
     # Request useful fields only
-    request = "SELECT " + ','.join(fields) + " FROM IBMTSSVC_Cluster"
+    request = stats_query('IBMTSSVC_Cluster', fields)
     result = [headers['IBMTSSVC_Cluster']['result']]
 
     sys_info = wbem_connection.ExecQuery(query_language, request)
@@ -231,188 +450,1275 @@ def get_system(wbem_connection):
 
 
 def datetime(dtstr):
-    """Convert datetime into human readable form"""
-    return time.strftime('%Y-%m-%d %H:%M:%S', time.strptime(dtstr, '%Y%m%d%H%M%S'))
+    """Convert CIM datetime 'yyyymmddhhmmss.mmmmmmsutc' into human readable local time of the collector. The UTC
+    offset 'sutc' in minutes is applied, so a storage system in another time zone or with a clock set to UTC is
+    shown, scheduled and checkpointed in the same time as the collector. Without the offset the time is local"""
+
+    if len(dtstr) < 25 or dtstr[21] not in '+-':
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.strptime(dtstr[:14], '%Y%m%d%H%M%S'))
+    stamp = calendar.timegm(time.strptime(dtstr[:14], '%Y%m%d%H%M%S')) - int(dtstr[21:25]) * 60
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stamp))
+
+
+def epoch(dtstr):
+    """Convert human readable datetime back into seconds since the Epoch"""
+    return time.mktime(time.strptime(dtstr, '%Y-%m-%d %H:%M:%S'))
+
+
+class Scheduler:
+    """Poll scheduler aligned to the statistics intervals of the storage system. The next poll is planned right after
+    the moment the next sample is expected: 'StatisticTime' of the last sample plus 'frequency', shifted by the
+    smallest observed publishing lag and the 'guard' time. The plan is kept on the monotonic clock, so the time
+    spent on query, parsing and output causes no drift. If a poll gets the same sample again, it is retried after
+    a short delay doubled each time. A poll is never planned more than two intervals ahead, whatever the clock of
+    the storage system says. Polls, stale polls, missed and late intervals are counted in 'counters'"""
+
+    def __init__(self, frequency, guard=sched_guard):
+        self.frequency = frequency
+        self.guard = guard
+        self.last = None                                # 'StatisticTime' of the last new sample, Epoch seconds
+        self.lag = None                                 # Time between 'StatisticTime' and seeing the sample
+        self.expected = None                            # Wall clock time the next sample is expected
+        self.retry = 0
+        self.deadline = time.monotonic()
+        self.counters = {'polls': 0, 'samples': 0, 'stale': 0, 'missed': 0, 'late': 0, 'max_skew': 0.0}
+
+    def update(self, stat_time):
+        """Account a poll which returned a sample with 'stat_time' and plan the next one.
+        Returns the number of intervals missed before the sample or None if the sample is not a new one"""
+
+        now = time.time()
+        self.counters['polls'] += 1
+
+        if self.last is not None and stat_time <= self.last:
+            # Too early, the storage system has not published the new sample yet
+            self.counters['stale'] += 1
+            self.retry = min(self.retry * 2 or sched_retry, max(sched_retry, self.frequency // 4))
+            self.deadline = time.monotonic() + self.retry
+            return None
+
+        missed = 0
+        if self.last is not None:
+            missed = max(0, round((stat_time - self.last) / self.frequency) - 1)
+            self.counters['missed'] += missed
+        if self.expected is not None:
+            skew = now - self.expected
+            self.counters['max_skew'] = max(self.counters['max_skew'], skew)
+            if skew > self.frequency / 2:
+                self.counters['late'] += 1
+        self.counters['samples'] += 1
+
+        lag = now - stat_time
+        if self.lag is None:
+            # The first sample could be published up to an interval ago: start from the lowest possible lag
+            self.lag = max(0.0, lag - self.frequency)
+        elif lag < self.lag or self.retry:
+            # The best estimate is the smallest lag. After retries we were too early, so take the real one
+            self.lag = lag
+        self.retry = 0
+        self.last = stat_time
+
+        self.expected = stat_time + self.frequency + self.lag + self.guard
+        # A clock of the storage system running ahead must not stall the polling
+        self.deadline = time.monotonic() + min(max(0.0, self.expected - now), 2 * self.frequency)
+        return missed
+
+    def wait(self):
+        time.sleep(max(0.0, self.deadline - time.monotonic()))
+
+
+def row_decoder(cim_class, fields, toint=True):
+    """Return a function converting a CIM instance of the 'cim_class' into a row: StatisticTime, InstanceID, [node,
+    port for IBMTSSVC_FCPortStatistics,] and the rest of the 'fields'. The decoder is built once per class and field
+    list: the field extractor is chosen in advance, each distinct StatisticTime is converted once as all the rows of
+    a sample share it, and parsed InstanceIDs are memoized. The memos are not locked, so every thread has its own
+    decoders"""
+
+    cache = vars(decoders)
+    key = (cim_class, tuple(fields), toint)
+    if key in cache:
+        return cache[key]
+
+    times = {}
+    ids = {}
+    id_type = str if cim_class == 'IBMTSSVC_FCPortStatistics' else int
+    fc_ports = cim_class == 'IBMTSSVC_FCPortStatistics' and 'ElementName' in fields
+    skip = ('StatisticTime', 'InstanceID', 'ElementName') if fc_ports else ('StatisticTime', 'InstanceID')
+    values = [fld for fld in fields if fld not in skip]
+
+    def decode(stat):
+        props = stat.properties
+
+        stat_time = props['StatisticTime'].value
+        if stat_time not in times:
+            if len(times) > 4:
+                times.clear()                                               # Old samples are not coming back
+            times[stat_time] = datetime(str(stat_time))
+
+        inst = props['InstanceID'].value
+        if inst not in ids:
+            ids[inst] = id_type(inst.split()[1])
+
+        ln = [times[stat_time], ids[inst]]
+        if fc_ports:
+            ports2nodes = props['ElementName'].value.split()
+            ln.append(int(ports2nodes[7]))                                  # Node
+            ln.append(int(ports2nodes[4]))                                  # Port
+
+        if toint:
+            # We want data to be converted to integers. Very useful for performance statistics.
+            # Warning! Use it on numbers only!
+            ln.extend([int(props[fld].value) for fld in values])
+        else:
+            # Save values as strings
+            ln.extend([props[fld].value for fld in values])
+        return ln
+
+    cache[key] = decode
+    return decode
 
 
-def get_stats(wbem_connection, cim_class, fields=(), inst_list=(), toint=True):
-    """Get performance statistics for the 'cim_class'.
+def stats_query(cim_class, fields, inst_filter=''):
+    """Form "select" request string"""
+    return "SELECT " + ','.join(fields) + " FROM " + cim_class + inst_filter
+
+
+def iter_stats(wbem_connection, cim_class, fields=(), inst_list=(), toint=True, timings=None):
+    """Yield performance statistics rows for the 'cim_class' one by one as they arrive.
        Optional 'fields' argument specifies columns to retrieve, defaults are taken from headers[cim_class].
-       Optional argument 'inst_list' is a filter to select desired instances."""
+       Optional argument 'inst_list' is a filter to select desired instances.
+       Instances are fetched with WBEM pull operations 'page_size' objects at a time, so a response is never
+       materialized as a whole. A long 'inst_list' filter is split into requests of 'filter_batch' instances each.
+       With a 'timings' dictionary the time spent waiting for instances and decoding them is added to its 'fetch' and
+       'decode' values, measured row by row without holding the rows back."""
 
     flds = list(fields)
     if not flds:
         # Use default fields
         flds = headers[cim_class]['request']                              # Fields to request
 
-    inst_filter = ''
+    inst_filters = ['']
     if inst_list:
         # Requesting selected only Instances
-        inst_selectors = {
-            'IBMTSSVC_BackendVolumeStatistics': 'BackendVolumeStats', 'IBMTSSVC_DiskDriveStatistics': 'DiskDriveStats',
-            'IBMTSSVC_FCPortStatistics': 'FCPortStatistics', 'IBMTSSVC_NodeStatistics': 'NodeStats',
-            'IBMTSSVC_StorageVolumeStatistics': 'StorageVolumeStats'
-        }
-
+        inst_list = list(inst_list)
         inst_filter_var = "' or InstanceID='" + inst_selectors[cim_class] + " "
-        inst_filter = " WHERE InstanceID='" + inst_selectors[cim_class] + " " + \
-                      inst_filter_var.join(str(inst) for inst in inst_list) + "'"
-
-    # Form "select" request string
-    request = "SELECT " + ','.join(flds) + " FROM " + cim_class + "{WHERE}".format(WHERE=inst_filter)
-
-    # header will be the first member in the result
-    result = [headers[cim_class]['result']]                                # Fields to be in the report header
+        inst_filters = [
+            " WHERE InstanceID='" + inst_selectors[cim_class] + " " +
+            inst_filter_var.join(str(inst) for inst in inst_list[b:b + filter_batch]) + "'"
+            for b in range(0, len(inst_list), filter_batch)
+        ]
 
-    # Request WBEM
-    stats = wbem_connection.ExecQuery(query_language, request)
-    if not stats:
+    decode = row_decoder(cim_class, flds, toint)
+
+    for inst_filter in inst_filters:
+        request = stats_query(cim_class, flds, inst_filter)
+
+        # Request WBEM. pywbem falls back to a single ExecQuery if the CIMOM does not support pull operations
+        stats = wbem_connection.IterQueryInstances(query_language, request, MaxObjectCount=page_size).generator
+
+        if timings is None:
+            for stat in stats:
+                yield decode(stat)
+            continue
+
+        clock = time.perf_counter
+        fetch = decoding = 0.0
+        t0 = clock()
+        for stat in stats:
+            t1 = clock()
+            row = decode(stat)
+            t2 = clock()
+            fetch += t1 - t0
+            decoding += t2 - t1
+            yield row
+            t0 = clock()
+        timings['fetch'] += fetch + clock() - t0
+        timings['decode'] += decoding
+
+
+def get_stats(wbem_connection, cim_class, inst_list=(), instruments=None):
+    """Get performance statistics for the 'cim_class' as a Sample, None if there is nothing to report.
+       Optional argument 'inst_list' is a filter to select desired instances.
+       'instruments' get the fetch, decode and sample stage times and the number of instances."""
+
+    if instruments:
+        timings = {'fetch': 0.0, 'decode': 0.0}
+        t0 = time.perf_counter()
+        result = Sample(headers[cim_class]['result'],
+                        iter_stats(wbem_connection, cim_class, inst_list=inst_list, timings=timings))
+        instruments.record('sample', time.perf_counter() - t0 - timings['fetch'] - timings['decode'])
+        instruments.record('fetch', timings['fetch'])
+        instruments.record('decode', timings['decode'])
+        instruments.count('instances', len(result))
+    else:
+        # Rows are streamed straight into the compact storage of the Sample
+        result = Sample(headers[cim_class]['result'], iter_stats(wbem_connection, cim_class, inst_list=inst_list))
+    if not result:
         return None                                                         # Nothing to report
 
-    for stat in stats:
-        # Handle 'InstanceID' and 'StatisticTime'
-        if cim_class != 'IBMTSSVC_FCPortStatistics':
-            ln = [
-                datetime(str(stat.properties['StatisticTime'].value).split('.')[0]),    # 'StatisticTime'
-                int(stat.properties['InstanceID'].value.split()[1])                     # 'InstanceID'
-            ]
-        else:
-            # FCPortStatistics is different to everything else
-            ln = [
-                datetime(str(stat.properties['StatisticTime'].value).split('.')[0]),    # 'StatisticTime'
-                str(stat.properties['InstanceID'].value.split()[1])                     # 'InstanceID'
-            ]
+    return result
 
-        # Collect all the rest of the fields in a loop
-        for fld in flds:
-            if fld != 'InstanceID' and fld != 'StatisticTime':
-                if cim_class == 'IBMTSSVC_FCPortStatistics' and fld == 'ElementName':
-                    ports2nodes = stat.properties[fld].value.split()
-                    ln.insert(2, int(ports2nodes[7]))                            # Node
-                    ln.insert(3, int(ports2nodes[4]))                            # Port
-                else:
-                    if toint:
-                        # We want data to be converted to integers. Very useful for performance statistics.
-                        # Warning! Use it on numbers only!
-                        ln.append(int(stat.properties[fld].value))
-                    else:
-                        # Save values as strings
-                        ln.append(stat.properties[fld].value)
-        result.append(ln)
 
-    return result
+class Sample:
+    """Compact storage for one statistics table. StatisticTime is kept once per sample as all the rows share it,
+    InstanceIDs are kept in an int array and counters in a single typed row-major buffer 'width' values per row,
+    where the columns are defined by the 'header', e.g. headers[cim_class]['result']. A counter column is taken
+    as a strided slice of the buffer, so deltas are computed column by column instead of cell by cell"""
+
+    __slots__ = ('header', 'time', 'ids', 'counters', 'width', '_index')
+
+    def __init__(self, header, rows=(), perf=2, typecode='q'):
+        self.header = header
+        self.time = ''
+        self.ids = array('q')
+        self.counters = array(typecode)
+        self.width = len(header) - perf                         # Counters per row
+        self._index = None
+        self.extend(rows, perf)
+
+    def extend(self, rows, perf=2):
+        """Add decoded rows [StatisticTime, InstanceID, counters...], e.g. a page of them"""
+        for ln in rows:
+            self.time = ln[0]
+            self.add(ln[1], ln[perf:])
+
+    @classmethod
+    def from_columns(cls, header, sample_time, ids, columns, typecode='d'):
+        """Build a sample out of the whole columns of values, e.g. computed deltas"""
+
+        sample = cls(header, typecode=typecode)
+        sample.time = sample_time
+        sample.ids = ids
+        sample.counters = array(typecode, bytes(sample.counters.itemsize * len(ids) * sample.width))
+        for c, col in enumerate(columns):
+            sample.counters[c::sample.width] = array(typecode, col)
+        return sample
+
+    def add(self, inst, values):
+        try:
+            self.ids.append(inst)
+        except TypeError:
+            self.ids = list(self.ids)                           # Non-numeric InstanceIDs can't be kept in the array
+            self.ids.append(inst)
+        self.counters.extend(values)
+        self._index = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index(self):
+        """InstanceID to row number mapping. Built on demand only, when rows of two samples have to be aligned"""
+        if self._index is None:
+            self._index = {inst: r for r, inst in enumerate(self.ids)}
+        return self._index
+
+    def column(self, c):
+        return self.counters[c::self.width]
+
+    def rows(self):
+        """Yield (InstanceID, counters) pairs"""
+        width = self.width
+        for r, inst in enumerate(self.ids):
+            yield inst, self.counters[r * width:(r + 1) * width]
+
+
+def column_delta(cur_col, prev_col):
+    """Subtract two aligned counter columns. A counter that went backwards was reset or wrapped on the storage
+    system, so the counted amount since then is the current value itself"""
+
+    diff = list(map(operator.sub, cur_col, prev_col))
+    if diff and min(diff) < 0:
+        diff = [d if d >= 0 else c for d, c in zip(diff, cur_col)]
+    return diff
 
 
 def build_delta(cim_class, stats, sample_frequency):
-    """Build relative performance data table based on absolute statistic values. 'index' column (default 0) contains
-    unique IDs to be used as keys. Argument 'date' (column 1) is date/time of the sample. Performance data starts
-    from default 'perf' (column 2). Row 'header' (default 0) is skipped, if needed set header=-1 to include line zero"""
+    """Build relative performance data table based on absolute statistic values. 'current' and 'previous' are
+    Sample objects, rows are matched by InstanceID, so created or deleted instances do not shift the other rows.
+    Instances without a previous sample are left out until the next interval, removed ones are dropped.
+    Rates are per second of the time between the samples, 'sample_frequency' is used if it can't be determined"""
 
     current = stats[cim_class]['current']
     previous = stats[cim_class]['previous']
 
-    index = 1                                                   # ID aka index column
-    date = 0                                                    # date/time column
-    header = 0                                                  # header row
-    perf = 2                                                    # performance columns start here
-
     # If we don't have previous data, return current
     if not previous:
         return current
 
-    # Initialize delta with header
-    result = [current[0]]
+    if current.time == previous.time:                           # We are still in the same time interval!
+        return None
 
-    for r in range(header + 1, len(current)):
-        row = [
-            current[r][date],                               # Date/time
-            current[r][index],                              # Index aka ID aka Instance ID
-        ]
+    # Use the real distance between the samples, it spans several intervals if some of them were missed
+    elapsed = epoch(current.time) - epoch(previous.time)
+    if elapsed > 0:
+        sample_frequency = elapsed
+
+    if current.ids == previous.ids:
+        # Fast path: the same instances in the same order, columns can be subtracted as they are
+        ids = current.ids
+        cur_cols = [current.column(c) for c in range(current.width)]
+        prev_cols = [previous.column(c) for c in range(previous.width)]
+    else:
+        # Align current rows with the previous sample by InstanceID
+        prev_index = previous.index()
+        pairs = [(r, prev_index[inst]) for r, inst in enumerate(current.ids) if inst in prev_index]
+        ids = current.ids[:0]
+        ids.extend(current.ids[r] for r, p in pairs)
+        cur_cols = [[col[r] for r, p in pairs] for col in map(current.column, range(current.width))]
+        prev_cols = [[col[p] for r, p in pairs] for col in map(previous.column, range(previous.width))]
+
+    columns = [
+        [d / sample_frequency for d in column_delta(cur_col, prev_col)]
+        for cur_col, prev_col in zip(cur_cols, prev_cols)
+    ]
+
+    names = current.header[2:]
+    for c, name in enumerate(names):
+        if name in key_columns:
+            columns[c] = list(cur_cols[c])
+
+    response_time_columns(columns, names)
+    return Sample.from_columns(current.header, current.time, ids, columns)
+
+
+def response_time_columns(columns, names):
+    """Response times calculation: time counter increment divided by the number of IOs for the same interval.
+    'columns' are rates named by 'names', response time columns hold time per second and are replaced in place"""
+
+    for ms, ios in response_times.items():
+        if ms in names and ios in names:
+            c = names.index(ms)
+            columns[c] = [t / n if n else 0.0 for t, n in zip(columns[c], columns[names.index(ios)])]
+
+
+def aggregate(stats, members, column, total=None):
+    """Aggregate 'stats' rows into groups. 'members' maps a group name to the list of its rows, a row may belong to
+    several groups or to none. Rates are summed, response times are turned back into time per second by the IO rates,
+    summed and divided by the summed IO rates like in build_delta(), so they are weighted by the number of IOs.
+    Each column is gathered in the group order once and reduced with a sum over a slice per group. With the 'total'
+    name a last row sums all the rows once. Returns a Sample where the ID is the group name, key columns are dropped"""
+
+    names = stats.header[2:]
+    counters = [c for c, name in enumerate(names) if name not in key_columns]
+    result = [names[c] for c in counters]
+
+    keys = sorted(members)
+    order = [r for key in keys for r in members[key]]
+    bounds = []
+    start = 0
+    for key in keys:
+        bounds.append((start, start + len(members[key])))
+        start += len(members[key])
+
+    if len(order) > 1:
+        gather = operator.itemgetter(*order)
+    else:
+        gather = lambda col: [col[r] for r in order]                # itemgetter() returns a value for one index
+
+    columns = []
+    for c in counters:
+        col = stats.column(c)
+        if names[c] in response_times and response_times[names[c]] in names:
+            col = list(map(operator.mul, col, stats.column(names.index(response_times[names[c]]))))
+        values = gather(col)
+        sums = [sum(values[a:b]) for a, b in bounds]
+        if total is not None:
+            sums.append(sum(col))
+        columns.append(sums)
+
+    response_time_columns(columns, result)
+
+    ids = keys + [total] if total is not None else keys
+    header = [stats.header[0], column] + result
+    return Sample.from_columns(header, stats.time, ids, columns, 'd')
+
+
+def rollup(stats, column, total='all'):
+    """Aggregate 'stats' rows per value of the key 'column', e.g. FC ports per node, and for all the rows together.
+    Returns a Sample where the ID is the 'column' value or 'total' for the last, cluster wide row"""
+
+    members = {}
+    for r, key in enumerate(stats.column(stats.header.index(column) - 2)):
+        members.setdefault(int(key), []).append(r)
+    return aggregate(stats, members, column, total)
+
+
+def ssh_query(commands, target, user, password, timeout=fleet_timeout):
+    """Run CLI 'commands' with '-delim ,' over one SSH session. Returns a list of rows per command, each row is a
+    {column header: value} dictionary. 'paramiko' is imported here as only the vdisk groupings need it"""
+
+    import paramiko
+
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(target, username=user, password=password, timeout=timeout)
+    try:
+        result = []
+        for command in commands:
+            stdin, stdout, stderr = client.exec_command(command + ' -delim ,', timeout=timeout)
+            lines = stdout.read().decode(errors='replace').splitlines()
+            if stdout.channel.recv_exit_status():
+                raise RuntimeError('"{}" failed: {}'.format(command, stderr.read().decode(errors='replace').strip()))
+            fields = lines[0].split(',') if lines else []
+            result.append([dict(zip(fields, ln.split(','))) for ln in lines[1:]])
+        return result
+    finally:
+        client.close()
+
+
+def get_groups(cache, kinds, target, user, password, timeout=fleet_timeout):
+    """Return {kind: {vdisk ID: [group, ...]}} for the selected 'kinds' of groupings. Vdisks are mapped to I/O
+    groups and pools by lsvdisk, to hosts by lshostvdiskmap. The mappings are kept in the 'cache' dictionary and
+    fetched again after 'groups_refresh' seconds. If fetching fails, the previous mappings are used and the next
+    attempt is made after 'fleet_backoff' seconds"""
+
+    now = time.monotonic()
+    if 'maps' in cache and now < cache['expires']:
+        return cache['maps']
+
+    commands = ['lsvdisk'] + (['lshostvdiskmap'] if 'host' in kinds else [])
+    try:
+        vdisks, *hosts = ssh_query(commands, target, user, password, timeout)
+    except Exception as err:
+        print(groups_warn.format(target, err), file=sys.stderr)
+        cache['expires'] = now + fleet_backoff
+        return cache.setdefault('maps', {})
+
+    maps = {kind: {} for kind in kinds}
+    for vd in vdisks:
+        if 'iogrp' in maps:
+            maps['iogrp'][int(vd['id'])] = [vd['IO_group_name']]
+        if 'pool' in maps:
+            maps['pool'][int(vd['id'])] = [vd['mdisk_grp_name']]          # 'many' for mirrored vdisks
+    for mapping in (hosts[0] if hosts else ()):
+        maps['host'].setdefault(int(mapping['vdisk_id']), []).append(mapping['name'])
+
+    cache['maps'] = maps
+    cache['expires'] = now + groups_refresh
+    return maps
+
+
+def output_tables(cim_class, delta, groups=None):
+    """Return [(name, metric prefix, table), ...] to report for the 'cim_class' delta: the table itself, its rollup
+    if any and its aggregates per group for each of the 'groups' mappings returned by get_groups()"""
+
+    tables = [(cim_class, metric_prefixes[cim_class], delta)]
+    if cim_class in rollups:
+        column = rollups[cim_class]
+        tables.append((cim_class + ' per ' + column, metric_prefixes[cim_class] + '_' + column.lower(),
+                       rollup(delta, column)))
+
+    for kind, mapping in (groups or {}).items():
+        members = {}
+        for r, inst in enumerate(delta.ids):
+            for group in mapping.get(inst, ()):
+                members.setdefault(group, []).append(r)
+        tables.append((cim_class + ' per ' + groupings[kind], metric_prefixes[cim_class] + '_' + kind,
+                       aggregate(delta, members, groupings[kind])))
+    return tables
+
+
+def select_rows(stats, column, count=0, threshold=None):
+    """Return a Sample with the rows of 'stats' whose 'column' value is not less than 'threshold', at most 'count' of
+    them with the highest values, ordered from the highest. The top rows are taken with a heap based partial sort.
+    'stats' is returned as is if it has no such column, e.g. a table of another selected class"""
+
+    if column not in stats.header[2:]:
+        return stats
+
+    col = stats.column(stats.header.index(column) - 2)
+    rows = range(len(stats))
+    if threshold is not None:
+        rows = [r for r in rows if col[r] >= threshold]
+    if count:
+        rows = heapq.nlargest(count, rows, key=col.__getitem__)
+    elif threshold is None:
+        return stats
+
+    ids = stats.ids[:0]
+    ids.extend(stats.ids[r] for r in rows)
+    columns = [[values[r] for r in rows] for values in map(stats.column, range(stats.width))]
+    return Sample.from_columns(stats.header, stats.time, ids, columns, stats.counters.typecode)
+
+
+def print_stats(stats, skip_header=False, skip_time=True, out_format='table', title=()):
+    """Printout stats table in the 'out_format' with a single buffered write. 'title' is a list of (name, value) pairs
+    naming the table, e.g. the target and the class. The 'table' format shows it as a line above the header, 'csv'
+    and 'json' repeat it in every row, 'bin' keeps it in the table metadata"""
+
+    if out_format == 'bin':
+        sys.stdout.buffer.write(render_binary(stats, title))
+        sys.stdout.buffer.flush()
+        return
+
+    sys.stdout.write(writers[out_format](stats, skip_header, skip_time, title))
+    sys.stdout.flush()
+
+
+def render_table(stats, skip_header, skip_time, title):
+    """Fixed width text table, the default output format"""
+
+    lines = []
+    id_width = 6
+    if not isinstance(stats.ids, array) and stats.ids:
+        id_width = max(id_width, max(len(str(inst)) for inst in stats.ids) + 1)    # Non-numeric InstanceIDs
+
+    time_fmt = '' if skip_time else '{:19s}'.format(stats.time).replace('%', '%%')
+    row_fmt = time_fmt + '%' + str(id_width) + 's' + \
+        ''.join('%16.0f' if fld in key_columns else '%16.2f' for fld in stats.header[2:]) + '\n'
+
+    # Header
+    if not skip_header:
+        if title:
+            lines.append(' '.join(str(val) for name, val in title) + '\n')
+        r_header = ''
+        if not skip_time:
+            r_header = '{0:>19s}'.format(stats.header[0])           # Date/Time
+        r_header += stats.header[1].rjust(id_width)                 # InstanceID
+        for fld in stats.header[2:]:                                # Add all the rest of the fields to the header
+            r_header += '{0:>16s}'.format(fld)
+        lines.append(r_header + '\n')
 
-        if current[r][date] == previous[r][date]:           # We are still in the same time interval!
-            return None
+    # Data
+    lines.extend(row_fmt % ((inst,) + tuple(values)) for inst, values in stats.rows())
+    return ''.join(lines)
+
+
+def render_csv(stats, skip_header, skip_time, title):
+    """CSV, the header is written once per table title"""
+
+    lines = []
+    names = [name for name, val in title]
+    prefix = ''.join(str(val) + delimiter_csv for name, val in title)
+    if not skip_time:
+        names.append(stats.header[0])
+        prefix += stats.time + delimiter_csv
+
+    key = tuple(title)
+    if not skip_header and key not in csv_headers:
+        csv_headers.add(key)
+        lines.append(delimiter_csv.join(names + stats.header[1:]) + '\n')
+
+    row_fmt = prefix.replace('%', '%%') + '%s' + \
+        ''.join(delimiter_csv + ('%.0f' if fld in key_columns else '%.2f') for fld in stats.header[2:]) + '\n'
+    lines.extend(row_fmt % ((inst,) + tuple(values)) for inst, values in stats.rows())
+    return ''.join(lines)
+
+
+def render_json(stats, skip_header, skip_time, title):
+    """JSON Lines: an object per row with the title fields, time, ID and all the counters"""
+
+    prefix = '{' + ''.join('{}: {}, '.format(json.dumps(name), json.dumps(val)) for name, val in title)
+    if not skip_time:
+        prefix += '"time": {}, '.format(json.dumps(stats.time))
+    row_fmt = prefix.replace('%', '%%') + '"id": %s' + \
+        ''.join(', {}: {}'.format(json.dumps(fld).replace('%', '%%'), '%.0f' if fld in key_columns else '%.2f')
+                for fld in stats.header[2:]) + '}\n'
+
+    return ''.join(row_fmt % ((json.dumps(inst),) + tuple(values)) for inst, values in stats.rows())
+
+
+def render_binary(stats, title=()):
+    """Compact columnar record: b'SVCB', metadata and row count as two little-endian uint32, JSON metadata, then
+    the InstanceID int64 array and the row-major counters array as they are kept in the Sample. Non-numeric
+    InstanceIDs are stored in the metadata instead"""
+
+    meta = {
+        'title': dict(title), 'time': stats.time, 'header': stats.header, 'typecode': stats.counters.typecode,
+        'itemsize': stats.counters.itemsize
+    }
+    ids = b''
+    if isinstance(stats.ids, array):
+        ids = stats.ids.tobytes()
+    else:
+        meta['ids'] = stats.ids
+    meta = json.dumps(meta).encode()
+
+    return b''.join((b'SVCB', struct.pack('<II', len(meta), len(stats)), meta, ids, stats.counters.tobytes()))
+
+
+def parse_binary(data, offset=0):
+    """Read back a render_binary() record at the 'offset' of the 'data' buffer. Returns the title dictionary, the
+    Sample and the offset of the next record. Raises ValueError if there is no valid record at the 'offset'"""
 
-        if current[r][index] == previous[r][index]:         # Subtract matrices if we have previous stats values ...
-            for c in range(perf, len(current[0])):
-                row.append(round(float(current[r][c] - previous[r][c]) / sample_frequency, 2))
-        else:                                               # ... or pre-fill the row with current values only
-            for c in range(perf, len(current[0])):
-                row.append(current[r][c])
-
-        if cim_class == 'IBMTSSVC_BackendVolumeStatistics' or cim_class == 'IBMTSSVC_StorageVolumeStatistics':
-            # Response times calculation
-            if row[8] and row[5]:
-                row[8] = round(float(row[8] / row[5]), 2)                       # ms/rIO
-            if row[9] and row[6]:
-                row[9] = round(float(row[9] / row[6]), 2)                       # ms/wIO
-            if row[10] and row[7]:
-                row[10] = round(float(row[10] / row[7]), 2)                     # ms/tIO
-
-        result.append(row)
+    if data[offset:offset + 4] != b'SVCB':
+        raise ValueError('No binary record at offset {}'.format(offset))
+    try:
+        meta_size, rows = struct.unpack_from('<II', data, offset + 4)
+    except struct.error:
+        raise ValueError('Truncated binary record at offset {}'.format(offset)) from None
+    offset += 12
+    meta = json.loads(bytes(data[offset:offset + meta_size]))
+    offset += meta_size
+
+    sample = Sample(meta['header'], typecode=meta['typecode'])
+    sample.time = meta['time']
+    if 'ids' in meta:
+        sample.ids = meta['ids']
+    else:
+        sample.ids.frombytes(data[offset:offset + rows * sample.ids.itemsize])
+        offset += rows * sample.ids.itemsize
+    size = rows * sample.width * meta['itemsize']
+    sample.counters.frombytes(data[offset:offset + size])
+    if len(sample.ids) != rows or len(sample.counters) != rows * sample.width:
+        raise ValueError('Truncated binary record at offset {}'.format(offset))
+    return meta['title'], sample, offset + size
+
+
+writers = {'table': render_table, 'csv': render_csv, 'json': render_json}
+
+
+def save_checkpoint(filename, cluster_id, stats):
+    """Write the 'previous' raw samples of all the classes of the 'stats' as render_binary() records titled with
+    the 'cluster_id' and the class. The records go to a temporary file renamed over the 'filename', so the file
+    always holds either the last or the new complete checkpoint"""
+
+    records = [render_binary(stats[cim_class]['previous'], (('cluster_id', cluster_id), ('class', cim_class)))
+               for cim_class in stats if stats[cim_class]['previous']]
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as ckpt:
+        ckpt.write(b''.join(records))
+        ckpt.flush()
+        os.fsync(ckpt.fileno())
+    os.replace(temp, filename)
+
+
+def load_checkpoint(filename, cluster_id, classes):
+    """Return {class: Sample} of the checkpoint 'filename' for the 'classes' of the cluster 'cluster_id'. Samples
+    of other clusters, with other headers or with StatisticTime older than 'checkpoint_age' are left out. A missing
+    or broken file restores nothing"""
+
+    try:
+        with open(filename, 'rb') as ckpt:
+            data = ckpt.read()
+    except OSError:
+        return {}
+
+    result = {}
+    offset = 0
+    try:
+        while offset < len(data):
+            title, sample, offset = parse_binary(data, offset)
+            cim_class = title.get('class')
+            if title.get('cluster_id') != cluster_id or cim_class not in classes:
+                continue
+            if sample.header != headers[cim_class]['result'] or time.time() - epoch(sample.time) > checkpoint_age:
+                continue
+            result[cim_class] = sample
+    except ValueError:
+        return {}
     return result
 
 
-def print_stats(stats, skip_header=False, skip_time=True):
-    """Printout stats table"""
+def export_delta(prefix, delta, system):
+    """Render a delta table for the exporter labeled with the cluster ID and name of the 'system' row"""
+    import svcexport
+
+    labels = (('cluster_id', system[0]), ('cluster', system[1]))
+    return svcexport.render_sample(prefix, delta, labels, skip=key_columns)
+
+
+def export_scheduler(scheduler, system):
+    """Render Scheduler counters for the exporter"""
+    import svcexport
+
+    labels = (('cluster_id', system[0]), ('cluster', system[1]))
+    return svcexport.render_values('svc_collector', scheduler.counters, labels)
+
+
+class Collector:
+    """Statistics collector of one storage system: its connection, statistics interval, Scheduler and the last
+    samples of the selected 'cim_classes'. A 'connection' may be given instead of the address and credentials, e.g. a
+    svcreplay.Replay log. pywbem is imported on the first connect only, so the rest of the module works without it.
+    With svcinstr.Instruments the stages of every poll are timed and the CIM operations are probed. Own connections
+    are kept in a svcdaemon.SessionPool of 'sessions': if a query fails and a standby session is there, the query is
+    retried on it at once.
+    With a 'checkpoint' file the last raw samples are saved after every poll and restored on connect, so the first
+    poll after a restart already gives a delta.
+
+        collector = Collector('address', 'user', 'password', ['IBMTSSVC_NodeStatistics'])
+        while True:
+            collector.wait()
+            for name, prefix, table, first in collector.poll():
+                print_stats(table)
+    """
+
+    def __init__(self, target='', user='', password='', cim_classes=('IBMTSSVC_NodeStatistics',), frequency=0,
+                 timeout=fleet_timeout, kinds=(), connection=None, instruments=None, sessions=1, checkpoint=''):
+        self.target = target
+        self.user = user
+        self.password = password
+        self.cim_classes = list(cim_classes)
+        self.requested = frequency                      # Report frequency asked for, seconds
+        self.timeout = timeout
+        self.kinds = kinds                              # Vdisk groupings, see get_groups()
+        self.connection = connection
+        self.instruments = instruments
+        self.checkpoint = checkpoint
+        self.pool = None
+        if connection is None:
+            import svcdaemon
+
+            self.pool = svcdaemon.SessionPool(self.session, get_system, lambda conn: conn.close(), sessions)
+        self.system = None                              # IBMTSSVC_Cluster row
+        self.frequency = 0
+        self.scheduler = None
+        self.groups = {}
+        self.data = {cim_class: {'current': [], 'previous': [], 'delta': []} for cim_class in self.cim_classes}
+        self.fresh = False                              # The poll in progress got a new sample
+
+    def session(self):
+        """Open a new WBEM connection to the storage system"""
+        import pywbem
+
+        connection = pywbem.WBEMConnection('https://' + self.target, (self.user, self.password), 'root/ibm',
+                                           no_verification=True, timeout=self.timeout)
+        if self.instruments:
+            import svcinstr
+
+            svcinstr.operation_probe(connection, self.instruments)
+        return connection
+
+    def connect(self):
+        """Connect and detect 'StatisticsFrequency'. Raises RuntimeError if the storage system can't report"""
+
+        if self.connection is None:
+            self.connection = self.pool.get()
+        system = get_system(self.connection)
+        if not system:
+            raise RuntimeError('There is no data for "IBMTSSVC_Cluster"')
+        if not system[1][8]:
+            raise RuntimeError('Statistics is turned off on the storage system. '
+                               'Enable it first: "svctask startstats -interval <1-60 minutes>"')
+        self.system = system[1]
+
+        # 60 minutes <= frequency >= 'Statistics Interval' value on the storage system
+        self.frequency = self.system[7] * 60
+        if self.frequency < self.requested <= 3600:
+            self.frequency = self.requested
+        if not self.scheduler:
+            self.scheduler = Scheduler(self.frequency)
+        self.scheduler.frequency = self.frequency
+
+        if self.checkpoint and not all(stats['previous'] for stats in self.data.values()):
+            for cim_class, sample in load_checkpoint(self.checkpoint, self.system[0], self.data).items():
+                if not self.data[cim_class]['previous']:
+                    self.data[cim_class]['previous'] = sample
+
+    def disconnect(self):
+        """Drop the connection after a failure, the next poll connects again. Samples are kept, so the first delta
+        after the reconnect is still valid"""
+        if self.pool and self.connection is not None:
+            self.pool.discard(self.connection)
+            self.connection = None
+        self.system = None
+
+    def reload(self):
+        """Open new sessions, detect the statistics interval and fetch the vdisk mappings again on the next poll.
+        Samples are kept"""
+        self.disconnect()
+        if self.pool:
+            self.pool.close()
+        self.groups.clear()
+
+    def keepalive(self):
+        """Health check the standby sessions and open the missing ones. Failures are reported, not raised: the
+        next poll tells if the storage system is really gone"""
+        if self.pool and self.system:
+            try:
+                self.pool.refresh()
+            except Exception as err:
+                print(fleet_warn.format(self.target, 'Standby session: {}'.format(err)), file=sys.stderr)
+
+    def wait(self, supervisor=None):
+        """Sleep until the next poll planned by the Scheduler. A svcdaemon.Supervisor wakes up on signals and runs
+        keepalive() before the poll"""
+        if not self.scheduler:
+            return
+        if supervisor:
+            supervisor.wait(self.scheduler.deadline, self.keepalive)
+        else:
+            self.scheduler.wait()
+
+    def fetch(self, cim_class):
+        """get_stats() of the 'cim_class', retried once on a standby session if the current one fails"""
+        try:
+            return get_stats(self.connection, cim_class, instruments=self.instruments)
+        except Exception:
+            if not self.pool or not self.pool.idle:
+                raise
+        self.pool.discard(self.connection)
+        self.connection = self.pool.get()
+        if self.instruments:
+            self.instruments.count('retries')
+        return get_stats(self.connection, cim_class, instruments=self.instruments)
+
+    def poll(self):
+        """Collect all the selected classes once. Returns [(name, metric prefix, table, first), ...] of the
+        output_tables() of every class, where 'first' marks raw counters of the first sample, or an empty list if
+        the storage system has not published a new sample yet. Classes with no instances are dropped"""
+
+        start = self.begin()
+        result = []
+        for cim_class in list(self.cim_classes):
+            tables = self.accept(cim_class, self.fetch(cim_class))
+            if tables is None:
+                break
+            result.extend(tables)
+        self.settle(start)
+        return result
+
+    def begin(self):
+        """Start a poll: connect if needed. Returns the start time for settle()"""
+        if not self.system:
+            self.connect()
+        self.fresh = False
+        return time.perf_counter()
+
+    def accept(self, cim_class, sample):
+        """Compute the delta of a fetched Sample of the 'cim_class'. Returns [(name, metric prefix, table, first),
+        ...] or None if the first class of the poll tells the storage system has not published a new sample yet"""
+
+        instruments = self.instruments
+        if not sample:
+            label = self.target + ': ' if self.target else ''
+            print(nodata_warn.format(label, cim_class), file=sys.stderr)
+            self.cim_classes.remove(cim_class)
+            return []
+        if not self.fresh:
+            # The first collected class tells if the storage system has published a new sample
+            missed = self.scheduler.update(epoch(sample.time))
+            if missed is None:
+                return None
+            if missed:
+                label = self.target + ': ' if self.target else ''
+                print(missed_warn.format(label, missed), file=sys.stderr)
+            self.fresh = True
+        previous = self.data[cim_class]['previous']
+        if previous and previous.time > sample.time:
+            self.data[cim_class]['previous'] = []               # Restored from a checkpoint ahead of the sample
+        self.data[cim_class]['current'] = sample
+        first = not self.data[cim_class]['previous']
+
+        if instruments:
+            t0 = time.perf_counter()
+        delta = build_delta(cim_class, self.data, self.frequency)
+        if instruments:
+            instruments.record('delta', time.perf_counter() - t0)
+        if delta is None:                                       # Still the same interval, an empty delta is valid
+            return []
+        self.data[cim_class]['delta'] = delta
+        self.data[cim_class]['previous'] = self.data[cim_class]['current']
+
+        groups = None
+        if self.kinds and cim_class == grouped_class:
+            groups = get_groups(self.groups, self.kinds, self.target, self.user, self.password, self.timeout)
+        if instruments:
+            t0 = time.perf_counter()
+        result = [(name, prefix, table, first) for name, prefix, table in output_tables(cim_class, delta, groups)]
+        if instruments:
+            instruments.record('rollup', time.perf_counter() - t0)
+        return result
+
+    def settle(self, start):
+        """Finish a poll started at 'start': checkpoint the samples and time the poll if it got a new sample. A
+        checkpoint that can't be written is warned about"""
+
+        instruments = self.instruments
+        if self.fresh and self.checkpoint:
+            if instruments:
+                t0 = time.perf_counter()
+            try:
+                save_checkpoint(self.checkpoint, self.system[0], self.data)
+            except OSError as err:
+                # A failed write, e.g. a full disk, costs the restart its first delta only
+                label = self.target + ': ' if self.target else ''
+                print(checkpoint_warn.format(label, self.checkpoint, err), file=sys.stderr)
+            if instruments:
+                instruments.record('checkpoint', time.perf_counter() - t0)
+
+        if instruments and self.fresh:
+            instruments.record('poll', time.perf_counter() - start)
+
+
+def read_inventory(filename, cim_classes, frequency=0, timeout=fleet_timeout, kinds=(), instruments=None, sessions=1,
+                   checkpoints=''):
+    """Read fleet inventory: one storage system per line as "address user password [nvmdF]", '#' starts a comment.
+    Returns a list of target state dictionaries, each with its own Collector and retry state. Collectors keep their
+    checkpoints in the 'checkpoints' directory, one file per address. Raises ValueError if the inventory can't be
+    read"""
+
+    targets = []
+    try:
+        with open(filename) as inventory:
+            for ln in inventory:
+                fld = ln.split('#')[0].split()
+                if not fld:
+                    continue
+                if len(fld) < 3:
+                    raise ValueError('Error! Wrong inventory line: "{}".'.format(ln.strip()))
+
+                classes = list(cim_classes)
+                if len(fld) > 3:
+                    classes = [class_opts['-' + c] for c in fld[3] if '-' + c in class_opts]
+                    if not classes:
+                        raise ValueError('Error! Wrong inventory line: "{}".'.format(ln.strip()))
+
+                targets.append({
+                    'target': fld[0], 'line': tuple(fld), 'next_poll': 0.0, 'failures': 0, 'future': None,
+                    'exported': set(),
+                    'collector': Collector(fld[0], fld[1], fld[2], classes, frequency, timeout, kinds,
+                                           instruments=instruments, sessions=sessions,
+                                           checkpoint=checkpoints and os.path.join(checkpoints,
+                                                                                   fld[0] + checkpoint_suffix))
+                })
+    except OSError:
+        raise ValueError(inventory_error.format(filename)) from None
+
+    return targets
+
+
+def merge_inventory(targets, fresh):
+    """Targets of a reread inventory: the unchanged lines keep their state, Collector and samples included.
+    Collectors of the removed lines which are not polling right now are disconnected"""
+
+    current = {tgt['line']: tgt for tgt in targets}
+    merged = [current.pop(tgt['line'], tgt) for tgt in fresh]
+    for tgt in current.values():
+        if not tgt['future']:
+            tgt['collector'].reload()
+    return merged
+
+
+def poll_target(collector):
+    """Fleet worker: check the standby sessions, then poll"""
+    collector.keepalive()
+    return collector.poll()
+
+
+def run_fleet(targets, workers=fleet_workers, skip_header=False, skip_time=True, exporter=None, out_format='table',
+              selection=(), reporter=None, supervisor=None, reload=None, detector=None, store=None):
+    """Poll all the fleet targets concurrently from a bounded thread pool. Every target has its own Collector with
+    a Scheduler aligned to its statistics intervals, so a slow or hung system neither delays nor shifts the others.
+    A worker thread only touches the state of its target. A failed target drops its connection and is retried
+    after an exponentially growing delay.
+    With an 'exporter' the delta tables are published to it instead of printing. 'selection' is a (column, count,
+    threshold) tuple of select_rows() arguments applied before the output. A svcinstr.Reporter gets the output
+    stage times, retries and the Scheduler counters of all the targets. A target left with no classes to collect
+    is dropped. The exported series of a failed or dropped target are removed, so they go stale.
+    With a svcdaemon.Supervisor, SIGHUP replaces the targets with the ones returned by 'reload' and SIGTERM stops
+    polling: the polls in flight are finished and reported before returning. A svcalert.Detector checks the delta
+    tables before the selection, a svcstore.Store keeps them"""
+
+    from concurrent import futures
+
+    instruments = reporter.instruments if reporter else None
+
+    pool = futures.ThreadPoolExecutor(max_workers=workers)
+    running = {}
+
+    def publish(tgt, name, metrics):
+        exporter.publish((tgt['target'], name), metrics)
+        tgt['exported'].add(name)
+
+    def unpublish(tgt):
+        if exporter:
+            exporter.remove(*[(tgt['target'], name) for name in tgt['exported']])
+        tgt['exported'].clear()
+
+    while running or (targets or supervisor) and not (supervisor and supervisor.stop):
+        if supervisor and supervisor.reloading() and reload:
+            try:
+                previous, targets = targets, merge_inventory(targets, reload())
+                for tgt in previous:
+                    if tgt not in targets and not tgt['future']:
+                        unpublish(tgt)
+            except ValueError as err:
+                print(err, 'The targets are kept.', file=sys.stderr)
+            if reporter:
+                reporter.reopen()
+
+        now = time.monotonic()
+        for tgt in targets:
+            if not tgt['future'] and tgt['next_poll'] <= now and not (supervisor and supervisor.stop):
+                tgt['future'] = pool.submit(poll_target, tgt['collector'])
+                running[tgt['future']] = tgt
+
+        wake = min([tgt['next_poll'] for tgt in targets if not tgt['future']] or [now + 1])
+        if supervisor:
+            wake = min(wake, now + 1)                           # Signal flags are checked every second
+        done, _ = futures.wait(list(running), timeout=max(0.0, wake - time.monotonic()),
+                                return_when=futures.FIRST_COMPLETED)
+
+        for future in done:
+            tgt = running.pop(future)
+            tgt['future'] = None
+            collector = tgt['collector']
+            if tgt not in targets:
+                collector.reload()                              # Removed from the inventory while polling
+                unpublish(tgt)
+            try:
+                result = future.result()
+            except Exception as err:
+                collector.disconnect()
+                unpublish(tgt)
+                tgt['failures'] += 1
+                tgt['next_poll'] = time.monotonic() + min(fleet_backoff * 2 ** (tgt['failures'] - 1), 3600)
+                print(fleet_warn.format(tgt['target'], err), file=sys.stderr)
+                if instruments:
+                    instruments.count('retries')
+                continue
+
+            tgt['failures'] = 0
+            if not collector.cim_classes:
+                # All the classes were dropped for no data: the Scheduler would never advance again
+                print(fleet_warn.format(tgt['target'], 'There is no data to collect.'), file=sys.stderr)
+                collector.reload()
+                unpublish(tgt)
+                targets = [other for other in targets if other is not tgt]
+                continue
+            tgt['next_poll'] = collector.scheduler.deadline
+
+            if instruments and result:
+                t0 = time.perf_counter()
+            if exporter and tgt in targets:
+                publish(tgt, 'scheduler', export_scheduler(collector.scheduler, collector.system))
+            for name, prefix, table, first in result:
+                if detector and not first:
+                    detector.check((tgt['target'], name), table, (('target', tgt['target']), ('class', name)))
+                if store and not first:
+                    store_delta(store, prefix, table, tgt['target'])
+                if selection:
+                    table = select_rows(table, *selection)
+                if exporter:
+                    if not first and tgt in targets:
+                        publish(tgt, name, export_delta(prefix, table, collector.system))
+                    continue
+                title = (('target', tgt['target']), ('class', name))
+                print_stats(table, skip_header, skip_time, out_format, title)
+            if instruments and result:
+                instruments.record('output', time.perf_counter() - t0)
+
+        if reporter:
+            reporter.tick(scheduler_counters([tgt['collector'].scheduler for tgt in targets]))
+
+    pool.shutdown()
+
+
+def recover(collector, backoff, supervisor, err, instruments=None):
+    """Drop the failed connection of the Collector and sleep for the next svcdaemon.Backoff delay or until a
+    signal. The samples are kept for the first delta after the reconnect"""
+
+    collector.disconnect()
+    delay = backoff.delay()
+    print(reconnect_warn.format(collector.target, err, delay), file=sys.stderr)
+    if instruments:
+        instruments.count('retries')
+    supervisor.sleep(delay)
+
+
+def store_delta(store, prefix, table, target):
+    """Append a delta table to the svcstore.Store. A failed write, e.g. a full disk, costs the table only"""
+    try:
+        store.append(prefix, table, target)
+    except OSError as err:
+        print(store_warn.format(target + ': ' if target else '', prefix, err), file=sys.stderr)
 
-    # Header printout
-    if not skip_header:
-        r_header = ''
-        if not skip_time:
-            r_header = '{0:>19s}'.format(stats[0][0])               # Date/Time
-        r_header += '{0:>6s}'.format(stats[0][1])                   # InstanceID
-        for fld in stats[0][2:]:                                    # Add all the rest of the fields to the header
-            r_header += '{0:>16s}'.format(fld)
-        print(r_header)
 
-    # Data printout
-    for ln in stats[1:]:
-        r_line = ''
-        if not skip_time:
-            r_line = '{0:19s}'.format(ln[0])                        # Date/Time
-        r_line += '{0:6d}'.format(ln[1])                            # InstanceID
+def scheduler_counters(schedulers):
+    """Sum of the counters of the 'schedulers', the highest 'max_skew'"""
+
+    total = {}
+    for scheduler in schedulers:
+        for name, val in (scheduler.counters.items() if scheduler else ()):
+            total[name] = max(total.get(name, val), val) if name == 'max_skew' else total.get(name, 0) + val
+    return total
+
 
-        # run through the rest of the fields:
-        for fld in ln[2:]:
-            r_line += '{0:16.2f}'.format(fld)
+def main():
+    params = get_cmdopts()
 
-        print(r_line, flush=True)
+    reporter = None
+    if params['report'] or params['report_file']:
+        import svcinstr
 
+        reporter = svcinstr.Reporter(svcinstr.Instruments(), params['report'] or 60, params['report_file'],
+                                     text=bool(params['report']))
+    instruments = reporter.instruments if reporter else None
 
-# Main goes below
-params = get_cmdopts()
+    exporter = None
+    if params['port']:
+        import svcexport
 
-# Establish connection
-wbemc = pywbem.WBEMConnection('https://' + params['target'], (params['user'], params['password']),
-                              'root/ibm',  no_verification=True)
+        exporter = svcexport.Exporter(params['port'])
 
-data['IBMTSSVC_Cluster']['current'] = get_system(wbemc)
-if not data:
-    exit_prog(1, 'Error! There is no data for "IBMTSSVC_Cluster"!')
+    detector = None
+    if params['alerts']:
+        import svcalert
 
-if not data['IBMTSSVC_Cluster']['current'][1][8]:
-    exit_prog(0, 'Statistics is turned off on the storage system.\n'
-                 'Enable it first: "svctask startstats -interval <1-60 minutes>"')
+        detector = svcalert.Detector(params['alerts'])
 
-if int(params['frequency']) < data['IBMTSSVC_Cluster']['current'][1][7] * 60 or int(params['frequency']) > 3600:
-    # 60 minutes <= frequency >= 'Statistics Interval' value on the storage system
-    params['frequency'] = data['IBMTSSVC_Cluster']['current'][1][7] * 60
-    print(frequency_warn.format(data['IBMTSSVC_Cluster']['current'][1][7]), file=sys.stderr)
+    store = None
+    if params['store']:
+        import svcstore
 
-while True:
-    # Performance data processing loop
-    data[params['cim_class']]['current'] = get_stats(wbemc, params['cim_class'])
-    if not data[params['cim_class']]['current']:
-        exit_prog(0, 'There is no data to collect for: "{}".'.format(params['cim_class']))
+        store = svcstore.Store(params['store'])
 
-    delta = build_delta(params['cim_class'], data, params['frequency'])
-    if delta:
-        data[params['cim_class']]['delta'] = delta
-        data[params['cim_class']]['previous'] = data[params['cim_class']]['current']
+    supervisor = backoff = None
+    sessions = 1
+    if params['daemon']:
+        import svcdaemon
+
+        supervisor = svcdaemon.Supervisor()
+        backoff = svcdaemon.Backoff()
+        sessions = svcdaemon.pool_size
+
+    if params['inventory']:
+        def reload():
+            return read_inventory(params['inventory'], params['cim_classes'], params['frequency'], params['timeout'],
+                                  params['groupings'], instruments, sessions, params['checkpoint'])
+
+        try:
+            targets = reload()
+        except ValueError as err:
+            exit_prog(1, str(err))
+        run_fleet(targets, params['workers'], bool(params['skip_header']), bool(params['skip_time']), exporter,
+                  params['out_format'], params['selection'], reporter, supervisor, reload, detector, store)
+        if reporter:
+            reporter.tick(force=True)
+        sys.exit(0)                                             # Stopped by a signal
+
+    # A replayed log stands for the connection offline
+    connection = None
+    if params['replay'] or params['record']:
+        import svcreplay
+
+        if params['replay']:
+            connection = svcreplay.Replay(params['replay'], params['speed'])
+        else:
+            import pywbem
+
+            connection = pywbem.WBEMConnection('https://' + params['target'], (params['user'], params['password']),
+                                               'root/ibm', no_verification=True)
+            if instruments:
+                svcinstr.operation_probe(connection, instruments)
+            connection = svcreplay.RecordingConnection(connection, svcreplay.Recorder(params['record']))
+
+    collector = Collector(params['target'], params['user'], params['password'], params['cim_classes'],
+                          params['frequency'], kinds=params['groupings'], connection=connection,
+                          instruments=instruments, sessions=sessions, checkpoint=params['checkpoint'])
+    pipeline = None
+    if params['depth'] or params['processes']:
+        import svcpipe
+
+        workers = {}
+        if params['processes']:
+            spec = ('wbem', params['target'], params['user'], params['password'], fleet_timeout)
+            if params['replay']:
+                spec = ('replay', params['replay'], params['speed'], 0.0)
+            workers = {cim_class: svcpipe.ClassWorker(spec, cim_class) for cim_class in params['cim_classes']
+                       if cim_class in svcpipe.process_classes}
+            if params['replay']:
+                # Records of the worker classes are skipped, not kept in memory
+                connection.only = {stats_query(cim_class, headers[cim_class]['request'])
+                                   for cim_class in ['IBMTSSVC_Cluster'] + params['cim_classes']
+                                   if cim_class not in workers}
+        pipeline = svcpipe.Pipeline(collector, params['depth'] or svcpipe.pipe_depth, workers)
+
+    def output(name, prefix, table, first, titled):
+        """Check, store, select and print or export a table of a poll"""
+
+        if detector and not first:
+            detector.check(name, table, (('cluster', collector.system[1]), ('class', name)))
+        if store and not first:
+            store_delta(store, prefix, table, collector.target)
+        if params['selection']:
+            table = select_rows(table, *params['selection'])
+
+        if exporter:
+            if not first:                                       # Raw counters of the first sample are not rates
+                exporter.publish(name, export_delta(prefix, table, collector.system))
+            return
 
         print_stats(
-            data[params['cim_class']]['delta'], skip_header=bool(params['skip_header']),
-            skip_time=bool(params['skip_time'])
+            table, skip_header=bool(params['skip_header']), skip_time=bool(params['skip_time']),
+            out_format=params['out_format'], title=(('class', name),) if titled else ()
         )
 
-    time.sleep(params['frequency'])
+    while not collector.system:
+        try:
+            collector.connect()
+        except RuntimeError as err:
+            if not supervisor:
+                exit_prog(1, 'Error! {}.'.format(err))
+            recover(collector, backoff, supervisor, err, instruments)
+        except EOFError:
+            exit_prog(1, 'Error! The replay log has no "IBMTSSVC_Cluster" record.')
+        except Exception as err:
+            if not supervisor:
+                raise
+            recover(collector, backoff, supervisor, err, instruments)
+        if supervisor and supervisor.stop:
+            sys.exit(0)
+
+    if collector.frequency != params['frequency']:
+        print(frequency_warn.format(collector.system[7]), file=sys.stderr)
+
+    while not (supervisor and supervisor.stop):
+        # Performance data processing loop. All the selected classes share the connection and the timer
+        if not params['replay']:
+            collector.wait(supervisor)                          # Replay is paced by the recorded times
+        if supervisor:
+            if supervisor.stop:
+                break
+            if supervisor.reloading():
+                collector.reload()
+                if reporter:
+                    reporter.reopen()
+                continue
+        try:
+            if pipeline:
+                # The number of tables is not known before they are output, tell them apart if there may be more
+                titled = params['out_format'] != 'table' or len(collector.cim_classes) > 1 or \
+                    any(cim_class in rollups for cim_class in collector.cim_classes) or \
+                    bool(params['groupings']) and grouped_class in collector.cim_classes
+                pipeline.poll(lambda *table: output(*table, titled))
+            else:
+                tables = collector.poll()
+        except EOFError:
+            break                                               # End of the replayed log
+        except Exception as err:
+            if not supervisor:
+                raise
+            recover(collector, backoff, supervisor, err, instruments)
+            continue
+        if backoff:
+            backoff.reset()
+
+        if not pipeline:
+            if instruments and tables:
+                t0 = time.perf_counter()
+            for table in tables:
+                output(*table, len(tables) > 1 or params['out_format'] != 'table')    # Tell the tables apart
+            if instruments and tables:
+                instruments.record('output', time.perf_counter() - t0)
+
+        if not collector.cim_classes:
+            exit_prog(0, 'There is no data to collect.')
+
+        if exporter:
+            exporter.publish('scheduler', export_scheduler(collector.scheduler, collector.system))
+        if reporter:
+            reporter.tick(collector.scheduler.counters)
+
+    if params['record']:
+        connection.recorder.close()
+    if pipeline:
+        pipeline.close()
+    if reporter:
+        reporter.tick(collector.scheduler.counters, force=True)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+#
+# Columnar history store of IBM SVC/Storwize delta tables
+#
+# The collector appends every delta table to a segment file per table and day, e.g. svc_vdisk/2026-10-13.seg.
+# A record keeps the InstanceIDs and every column as a contiguous array of doubles, so a query reads only the
+# columns it needs straight from the memory-mapped segment. Every record gets a JSON line in the index file of the
+# segment, e.g. svc_vdisk/2026-10-13.idx, with its offset, StatisticTime, target, InstanceID range and the minimum
+# and maximum of every column. A query skips the days out of its time range by the file names and the records
+# whose time, target, InstanceID range or column summaries can't match its conditions by the index, and evaluates
+# the conditions on the condition columns of the remaining records only.
+#
+# Usage:
+#   svcstore.py directory
+# Lists the tables of the store with the days, records, rows, time range and column summaries of each segment
+#   svcstore.py directory table [-f from] [-t to] [-w condition] ... [-i IDs] [-a address] [-c columns]
+#       [-o table|csv|json]
+# Prints the rows of the table, e.g. svc_vdisk, from the time "from" to "to" ("YYYY-MM-DD[ HH[:MM[:SS]]]") that
+# meet all the conditions "column>value" (or >=, <, <=, =), have one of the comma separated InstanceIDs and come
+# from the address. Only the comma separated columns are shown if given
+
+
+import getopt
+import json
+import mmap
+import operator
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import compress, repeat
+
+
+magic = b'SVCS'
+record_format = '<4sII'                         # Magic, metadata size, rows
+segment_suffix = '.seg'
+index_suffix = '.idx'
+
+operators = {'>=': operator.ge, '<=': operator.le, '>': operator.gt, '<': operator.lt, '=': operator.eq}
+
+
+def render_record(sample, target=''):
+    """Columnar record of a Sample: magic, metadata size and rows, JSON metadata, the InstanceID int64 array unless
+    InstanceIDs are not numeric and kept in the metadata, then every column as an array of doubles"""
+
+    meta = {'time': sample.time, 'target': target, 'header': sample.header}
+    ids = b''
+    if isinstance(sample.ids, array):
+        ids = sample.ids.tobytes()
+    else:
+        meta['ids'] = list(sample.ids)
+    meta = json.dumps(meta).encode()
+
+    columns = [sample.column(c) for c in range(sample.width)]
+    columns = [(col if col.typecode == 'd' else array('d', col)).tobytes() for col in columns]
+    return b''.join([struct.pack(record_format, magic, len(meta), len(sample)), meta, ids] + columns)
+
+
+def index_entry(sample, target, offset):
+    """Index line of a record: offset, time, target, rows, column summaries and the range and sorted flag of numeric
+    InstanceIDs"""
+
+    entry = {'offset': offset, 'time': sample.time, 'target': target, 'rows': len(sample)}
+    if len(sample):
+        if isinstance(sample.ids, array):
+            entry['ids'] = [min(sample.ids), max(sample.ids)]
+            entry['sorted'] = all(map(operator.le, sample.ids, sample.ids[1:]))
+        columns = [sample.column(c) for c in range(sample.width)]
+        entry['min'] = dict(zip(sample.header[2:], map(min, columns)))
+        entry['max'] = dict(zip(sample.header[2:], map(max, columns)))
+    return entry
+
+
+class Store:
+    """Append delta tables to the segment files in the 'directory'"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def append(self, table, sample, target=''):
+        """Add a Sample to the segment of the 'table', e.g. a metric prefix like svc_vdisk, for the day of its
+        StatisticTime. The record is written before its index line, so an interrupted append leaves at most an
+        unindexed record which is never read"""
+
+        path = os.path.join(self.directory, table)
+        os.makedirs(path, exist_ok=True)
+        name = os.path.join(path, sample.time[:10])
+        with open(name + segment_suffix, 'ab') as segment:
+            offset = segment.tell()
+            segment.write(render_record(sample, target))
+        with open(name + index_suffix, 'a') as index:
+            index.write(json.dumps(index_entry(sample, target, offset)) + '\n')
+
+
+def read_index(filename):
+    """Index entries of a segment. A line cut by an interrupted append is skipped"""
+
+    entries = []
+    with open(filename) as index:
+        for ln in index:
+            try:
+                entries.append(json.loads(ln))
+            except ValueError:
+                pass
+    return entries
+
+
+def parse_condition(text):
+    """Split "column>value" into (column, operator, value)"""
+
+    for sign in operators:                      # Two character operators come first
+        column, found, value = text.partition(sign)
+        if found and column:
+            return column.strip(), sign, float(value)
+    raise ValueError('Wrong condition "{}"'.format(text))
+
+
+def time_bound(text, upper=False):
+    """Complete "YYYY-MM-DD[ HH[:MM[:SS]]]" to a full StatisticTime, the first or the last second of the period"""
+    full = '9999-12-31 23:59:59' if upper else '0000-01-01 00:00:00'
+    return text + full[len(text):] if text else ('' if not upper else full)
+
+
+def pruned(entry, start, end, conditions, ids, targets, columns=()):
+    """True if the record of the index 'entry' can't have a matching row or lacks some of the 'columns'"""
+
+    if not entry['rows'] or entry['time'] < start or entry['time'] > end:
+        return True
+    if targets and entry['target'] not in targets:
+        return True
+    if any(column not in entry['min'] for column in columns):
+        return True
+    if ids and 'ids' in entry and not any(isinstance(inst, int) and entry['ids'][0] <= inst <= entry['ids'][1]
+                                          for inst in ids):
+        return True
+    for column, sign, value in conditions:
+        low, high = entry['min'].get(column), entry['max'].get(column)
+        if low is None:
+            return True                         # No such column in this table
+        if sign in ('>', '>=') and not operators[sign](high, value):
+            return True
+        if sign in ('<', '<=') and not operators[sign](low, value):
+            return True
+        if sign == '=' and not low <= value <= high:
+            return True
+    return False
+
+
+def scan_record(view, offset, conditions, ids, columns, ordered=False):
+    """Return the metadata, matching InstanceIDs and [column values, ...] of the 'columns' of the record at the
+    'offset' of a segment 'view'. Conditions are evaluated column by column on the rows left by the previous ones,
+    InstanceIDs of an 'ordered' record are looked up instead of scanned"""
+
+    tag, meta_size, rows = struct.unpack_from(record_format, view, offset)
+    if tag != magic:
+        raise ValueError('No record at offset {}'.format(offset))
+    offset += struct.calcsize(record_format)
+    meta = json.loads(bytes(view[offset:offset + meta_size]))
+    offset += meta_size
+
+    names = meta['header'][2:]
+    if 'ids' in meta:
+        inst_ids = meta['ids']
+    else:
+        inst_ids = view[offset:offset + rows * 8].cast('q')
+        offset += rows * 8
+
+    def column(name):
+        start = offset + names.index(name) * rows * 8
+        return view[start:start + rows * 8].cast('d')
+
+    selected = range(rows)
+    try:
+        if ids:
+            if ordered and isinstance(inst_ids, memoryview) and len(ids) < rows // 16:
+                found = (bisect_left(inst_ids, inst) for inst in ids if isinstance(inst, int))
+                selected = sorted(r for r in found if r < rows and inst_ids[r] in ids)
+            else:
+                selected = [r for r in selected if inst_ids[r] in ids]
+        for name, sign, value in conditions:
+            with column(name) as col:
+                if len(selected) == rows:
+                    selected = list(compress(range(rows), map(operators[sign], col, repeat(value))))
+                else:
+                    selected = [r for r in selected if operators[sign](col[r], value)]
+            if not selected:
+                break
+
+        values = []
+        for name in columns:
+            with column(name) as col:
+                values.append([col[r] for r in selected])
+        result_ids = [inst_ids[r] for r in selected]
+    finally:
+        if isinstance(inst_ids, memoryview):
+            inst_ids.release()                  # The segment can't be unmapped while a view is alive
+    return meta, result_ids, values
+
+
+def query(directory, table, start='', end='', conditions=(), ids=(), targets=(), columns=()):
+    """Yield (target, Sample) of every stored delta of the 'table' in the time range with the rows meeting all the
+    'conditions' [(column, operator sign, value), ...], the 'ids' and the 'targets', showing the 'columns'
+    (default all). Segments are read with mmap, only the pages of the needed columns are touched"""
+
+    import svcstats
+
+    start, end = time_bound(start), time_bound(end, True)
+    ids = set(ids) | {str(inst) for inst in ids}            # FC port InstanceIDs are kept as text
+    path = os.path.join(directory, table)
+    days = sorted(name[:-len(segment_suffix)] for name in os.listdir(path) if name.endswith(segment_suffix))
+
+    for day in days:
+        if day < start[:10] or day > end[:10]:
+            continue
+        name = os.path.join(path, day)
+        try:
+            entries = [entry for entry in read_index(name + index_suffix)
+                       if not pruned(entry, start, end, conditions, ids, targets, columns)]
+        except OSError:
+            continue
+        if not entries:
+            continue
+
+        with open(name + segment_suffix, 'rb') as segment, \
+                mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for entry in entries:
+                    meta, result_ids, values = scan_record(view, entry['offset'], conditions, ids,
+                                                           columns or list(entry['min']), entry.get('sorted', False))
+                    if not result_ids:
+                        continue
+                    header = meta['header'][:2] + list(columns or meta['header'][2:])
+                    ids_array = result_ids if 'ids' in meta else array('q', result_ids)
+                    yield meta['target'], svcstats.Sample.from_columns(header, meta['time'], ids_array, values)
+            finally:
+                view.release()
+
+
+def summary(directory):
+    """Yield a line per segment of every table in the store: day, records, rows, time range, column ranges"""
+
+    for table in sorted(os.listdir(directory)):
+        path = os.path.join(directory, table)
+        if not os.path.isdir(path):
+            continue
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(index_suffix):
+                continue
+            entries = [entry for entry in read_index(os.path.join(path, name)) if entry['rows']]
+            if not entries:
+                continue
+            ranges = ' '.join('{}={:.2f}..{:.2f}'.format(column, min(entry['min'][column] for entry in entries),
+                                                         max(entry['max'][column] for entry in entries))
+                              for column in entries[0]['min'])
+            yield '{} {} records {} rows {} targets {} {}..{} {}'.format(
+                table, name[:-len(index_suffix)], len(entries), sum(entry['rows'] for entry in entries),
+                ','.join(sorted({entry['target'] or '-' for entry in entries})), entries[0]['time'][11:],
+                entries[-1]['time'][11:], ranges)
+
+
+def usage(err_code=1, err_text=''):
+    if err_text:
+        print(err_text, '\n', file=sys.stderr)
+
+    print('Query the columnar history store of svcstats.py -S\n'
+          '\n'
+          'Usage:\n'
+          '\tsvcstore.py directory\n'
+          '\tsvcstore.py directory table [-f from] [-t to] [-w condition] ... [-i IDs] [-a address] [-c columns]\n'
+          '\t\t[-o table|csv|json]\n'
+          '\n'
+          'Options:\n'
+          '\tdirectory\n'
+          'List the tables of the store with the records, rows, time range and column ranges per day\n'
+          '\ttable\n'
+          'Table to query, e.g. svc_vdisk, svc_fcport_node or svc_vdisk_pool\n'
+          '\t[-f from] [-t to]\n'
+          'Time range as "YYYY-MM-DD[ HH[:MM[:SS]]]", e.g. -f "2026-10-13 02" -t "2026-10-13 02" for 02:00-02:59\n'
+          '\t[-w condition]\n'
+          'Show the rows meeting the condition "column>value", >=, <, <= or = are supported as well. Several\n'
+          'conditions must be all met, e.g. -w "ms/wIO>20" -w "wIO/s>=100"\n'
+          '\t[-i IDs]\n'
+          'Comma separated InstanceIDs to show\n'
+          '\t[-a address]\n'
+          'Show the rows of the storage system only\n'
+          '\t[-c columns]\n'
+          'Comma separated columns to show, all of them by default\n'
+          '\t[-o table|csv|json]\n'
+          'Output format, default is "table"\n')
+    sys.exit(err_code)
+
+
+def main():
+    if len(sys.argv) < 2:
+        usage(1)
+    if len(sys.argv) == 2:
+        for ln in summary(sys.argv[1]):
+            print(ln)
+        return
+
+    directory, table = sys.argv[1:3]
+    try:
+        opts, args = getopt.getopt(sys.argv[3:], 'f:t:w:i:a:c:o:')
+    except getopt.GetoptError as err:
+        usage(1, str(err))
+
+    start = end = ''
+    conditions = []
+    ids = []
+    targets = []
+    columns = []
+    out_format = 'table'
+    for opt, arg in opts:
+        try:
+            if opt == '-f':
+                start = arg
+            elif opt == '-t':
+                end = arg
+            elif opt == '-w':
+                conditions.append(parse_condition(arg))
+            elif opt == '-i':
+                ids = [int(inst) if inst.isdigit() else inst for inst in arg.split(',')]
+            elif opt == '-a':
+                targets.append(arg)
+            elif opt == '-c':
+                columns = arg.split(',')
+            elif opt == '-o':
+                if arg not in ('table', 'csv', 'json'):
+                    raise ValueError('Wrong output format specified')
+                out_format = arg
+        except ValueError as err:
+            usage(1, 'Error! {}.'.format(err))
+
+    import svcstats
+
+    if not os.path.isdir(os.path.join(directory, table)):
+        svcstats.exit_prog(1, 'Error! There is no table "{}" in "{}".'.format(table, directory))
+    for target, sample in query(directory, table, start, end, conditions, ids, targets, columns):
+        svcstats.print_stats(sample, skip_time=False, out_format=out_format, title=(('target', target),))
+
+
+if __name__ == '__main__':
+    main()